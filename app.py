@@ -1,21 +1,37 @@
+import time
+
+_script_start = time.perf_counter()
+
 import streamlit as st
 
-from src.chat import Chat
 from src.database import *
-from src.verify_doc import VerifyDoc
+from src.metrics import print_metrics, record_timing, timer
 
 
-# Initialize Snowflake connection
+# Initialize the Snowflake session pool, shared by every browser session
 @st.cache_resource
 def init_snowflake():
-    se = create_snowflake_session()
-    if not verify_cortex_access(se):
-        st.error("Error: Unable to access required Cortex functions")
-        st.stop()
-    if not init_database(se):
-        st.error("Error: Unable to initialize the database")
-        st.stop()
-    return se
+    with timer("startup.init_snowflake"):
+        pool = create_session_pool()
+        with pool.session() as se:
+            current_version = get_schema_version(se)
+            # Listing the Cortex functions is only worth it when we are about to (re)build the schema
+            if current_version < SCHEMA_VERSION and not verify_cortex_access(se):
+                st.error("Error: Unable to access required Cortex functions")
+                st.stop()
+            if not init_database(se, current_version):
+                st.error("Error: Unable to initialize the database")
+                st.stop()
+    return pool
+
+
+# Runs once per process, after the first full render
+@st.cache_resource
+def report_startup_metrics():
+    record_timing("startup.first_render", time.perf_counter() - _script_start)
+    print_metrics("startup.")
+    print_metrics("import.")
+    return True
 
 
 # Page config
@@ -25,9 +41,8 @@ st.set_page_config(
     layout="wide"
 )
 
-# Initialize session
-session = init_snowflake()
-css_verified = get_css(session)
+# Initialize session pool
+session_pool = init_snowflake()
 
 
 # Sidebar
@@ -43,9 +58,20 @@ with st.sidebar:
         "❓ Ask a Question"
     ])
 
-# Main content
-if page == "📄 Add & Verify Document":
-    VerifyDoc(st, session, css_verified).verify_doc()
+    pool_stats = session_pool.stats()
+    st.caption(f"Snowflake sessions in use: {pool_stats['in_use']}/{pool_stats['max_size']}")
+
+# Main content - pages are imported lazily so each one only loads what it needs
+try:
+    if page == "📄 Add & Verify Document":
+        with timer("startup.import.verify_page"):
+            from src.verify_doc import VerifyDoc
+        VerifyDoc(st, session_pool).verify_doc()
 
-else:  # Ask a Question
-    Chat(st, session, css_verified).chat()
\ No newline at end of file
+    else:  # Ask a Question
+        with timer("startup.import.chat_page"):
+            from src.chat import Chat
+        Chat(st, session_pool).chat()
+finally:
+    # Also when the page stops or reruns early
+    report_startup_metrics()
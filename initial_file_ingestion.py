@@ -1,66 +1,96 @@
+import io
 import os
+import re
 import time
 from typing import List
 
-from PyPDF2 import PdfReader, PdfWriter
+from src.claim_index import build_claim_index
+from src.config import INGESTION_CONFIG, TEXT_LAYER_CONFIG
 from src.database import *
+from src.ingestion_scheduler import IngestionScheduler, insert_chunks_sql
+from src.metrics import increment, print_metrics, timed_import, timer
+from src.profiles import ACTIVE_PROFILE, PipelineProfile
+from src.text_layer import extract_page_texts, split_by_quality
 
-chunk_page_size = 200
 documents_dir_path = os.path.join(os.path.dirname(__file__), "documents")
-split_files_dir_path = os.path.join(os.path.dirname(__file__), "tmp", "split_files")
+LOCAL_TEXT_TABLE = "local_page_text"
+UNSAFE_FILE_NAME_CHARS = re.compile(r"[^A-Za-z0-9_.-]")
 
 
 def init_connection_and_db():
-    session = create_snowflake_session()
-    if init_database(session):
-        return session
-    else:
-        raise Exception("Error: Unable to access required Cortex functions")
-
-
-def write_file_to_stage(session, file: str, stage: str):
-    print(f"uploading {file} to @{stage}")
-    res = session.sql(f"PUT file://{file} @{stage} auto_compress=FALSE OVERWRITE=TRUE").collect()
-    if not all([r["status"] == "UPLOADED" for r in res]):
-        raise Exception(f"Error: Unable to upload {file} to @{stage}")
-    print(f"{file} uploaded")
-    print(res)
+    pool = create_session_pool()
+    with pool.session("ingestion") as session:
+        if not init_database(session):
+            raise Exception("Error: Unable to access required Cortex functions")
+    return pool
+
+
+def write_stream_to_stage(session, stream, name: str, stage: str):
+    """Upload an in-memory file to the stage as name, without writing it to local disk."""
+    print(f"uploading {name} to @{stage}")
+    res = session.file.put_stream(stream, f"@{stage}/{name}", auto_compress=False, overwrite=True)
+    if res.status != "UPLOADED":
+        raise Exception(f"Error: Unable to upload {name} to @{stage}")
+    print(f"{name} uploaded")
     return res
 
 
-def write_page_range_to_stage(session, reader: PdfReader, split_file_name: str, stage: str, page_range: range):
-    writer = PdfWriter()
-    for page_num, page in enumerate(reader.pages, 1):
-        if page_num in page_range:
-            writer.add_page(page)
-    with open(split_file_name, 'wb') as out:
-        writer.write(out)
-    res = write_file_to_stage(session, split_file_name, stage)
-    print(res)
-    os.remove(split_file_name)
+def write_page_range_to_stage(session, reader, split_file_name: str, stage: str, page_range: range):
+    writer = timed_import("PyPDF2").PdfWriter()
+    for page_idx in page_range:
+        writer.add_page(reader.pages[page_idx])
+    # Only one part is held in memory at a time, however large the document
+    with io.BytesIO() as buffer:
+        writer.write(buffer)
+        buffer.seek(0)
+        write_stream_to_stage(session, buffer, split_file_name, stage)
     return True
 
 
-def chunk_and_upload_file(session, file: str, stage: str, chunk_size: int):
-    reader = PdfReader(file)
-    pages = (0, chunk_size)
-    pages_in_file = len(reader.pages)
-    split_file_path = os.path.join(split_files_dir_path, os.path.basename(file)).replace(" ", "_")
-    uploaded_files = []
-    while pages[0] < pages_in_file:
-        split_file_name = f'{split_file_path.replace(".pdf", "")}_page_{pages[0]}-{pages[1]}.pdf'
-        page_range = range(pages[0], pages[1])
-        write_page_range_to_stage(session, reader, split_file_name, stage, page_range)
-        uploaded_files.append(split_file_name)
-        pages = (pages[1], pages[1] + chunk_size)
-    return uploaded_files
-
+def chunk_and_upload_file(session, file, stage: str, chunk_size: int) -> List[dict]:
+    """Split the file into parts of at most chunk_size pages and upload them to the stage.
 
-def upload_file_to_stage(session, file: str, stage: str):
-    print(f"start processing {file}")
-    uploaded_files = chunk_and_upload_file(session, file, stage, chunk_page_size)
-    print(f"{file} processed")
-    return uploaded_files
+    file is a path or an in-memory PDF with a name, like a Streamlit UploadedFile.
+    Runs of pages with a good text layer become their own parts and carry the locally extracted
+    text, so only the other parts need PARSE_DOCUMENT. Returns one dict per part with its
+    relative_path, pages and text (None when the part must be parsed).
+    """
+    file_name = file if isinstance(file, str) else file.name
+    reader = timed_import("PyPDF2").PdfReader(file)
+    pages_in_file = len(reader.pages)
+    page_texts = None
+    if TEXT_LAYER_CONFIG["enabled"]:
+        page_texts = extract_page_texts(file, pages_in_file)
+    # Staged names end up in COPY FILES and REMOVE statements, so keep them to safe characters
+    split_file_prefix = UNSAFE_FILE_NAME_CHARS.sub("_", os.path.splitext(os.path.basename(file_name))[0])
+    parts = []
+    for window_start in range(0, pages_in_file, chunk_size):
+        window_end = min(window_start + chunk_size, pages_in_file)
+        for start, end, text in split_by_quality(page_texts, window_start, window_end):
+            split_file_name = f'{split_file_prefix}_page_{start}-{end}.pdf'
+            # Every part is staged, also the locally extracted ones, so chunks link to their pages
+            write_page_range_to_stage(session, reader, split_file_name, stage, range(start, end))
+            parts.append({"relative_path": split_file_name, "pages": (start, end), "text": text})
+    local_pages = sum(end - start for start, end in (part["pages"] for part in parts if part["text"] is not None))
+    increment("ingestion.local_text_pages", local_pages)
+    increment("ingestion.parsed_pages", pages_in_file - local_pages)
+    print(f"{local_pages} of {pages_in_file} pages of {file_name} have a good text layer")
+    return parts
+
+
+def upload_file_to_stage(session, file, stage: str, profile: PipelineProfile = ACTIVE_PROFILE) -> List[dict]:
+    file_name = file if isinstance(file, str) else file.name
+    print(f"start processing {file_name}")
+    parts = chunk_and_upload_file(session, file, stage, profile.split_pages)
+    print(f"{file_name} processed")
+    return parts
+
+
+def copy_parts_between_stages(session, parts: List[dict], from_stage: str, to_stage: str):
+    """Copy staged parts to another stage server-side, instead of uploading them again."""
+    files = ", ".join(f"'{part['relative_path']}'" for part in parts)
+    print(f"copying {len(parts)} files from @{from_stage} to @{to_stage}")
+    session.sql(f"COPY FILES INTO @{to_stage} FROM @{from_stage} FILES = ({files})").collect()
 
 
 def verify_files_in_stage(session, stage: str) -> bool:
@@ -73,45 +103,78 @@ def verify_files_in_stage(session, stage: str) -> bool:
         return False
 
 
-def chunks_into_table(session, stage: str, table: str, max_retries: int = 5, retry_delay: int = 10):
-    """Insert chunks into table with retry mechanism"""
+def list_stage_files(session, stage: str) -> List[str]:
+    """Return the relative paths of all files in the stage directory"""
+    rows = session.sql(f"select relative_path from directory(@{stage})").collect()
+    return [row["RELATIVE_PATH"] for row in rows]
+
+
+def chunks_into_table(session, stage: str, table: str, relative_paths: List[str] = None,
+                      max_retries: int = 5, retry_delay: int = 10, profile: PipelineProfile = ACTIVE_PROFILE):
+    """Parse and chunk staged files into table, one asynchronous job per file.
+
+    Only the given relative paths are ingested; when none are given, every file in the stage is.
+    Returns True when all files were ingested.
+    """
     print(f"inserting chunks from {stage}")
-    
+
     for attempt in range(max_retries):
-        if not verify_files_in_stage(session, stage):
-            print(f"Files not yet available in stage. Attempt {attempt + 1}/{max_retries}")
-            time.sleep(retry_delay)
-            continue
-
-        chunking_sql = (f"insert into {table}"
-                      f" (relative_path, size, file_url, scoped_file_url, chunk) "
-                      f"select relative_path, size, file_url, "
-                      f"build_scoped_file_url(@{stage}, relative_path) as scoped_file_url,  "
-                      f"t.chunk as chunk "
-                      f"from directory(@{stage}),  "
-                      f"TABLE(text_chunker (TO_VARCHAR(SNOWFLAKE.CORTEX.PARSE_DOCUMENT(@{stage},  "
-                      f"relative_path, {{'mode': 'LAYOUT'}})))) as t")
-        
-        print("Executing query:")
-        print(chunking_sql)
-        
-        try:
-            results = session.sql(chunking_sql).collect()
-            print("Query results:", results)
-            
-            if results and results[0] and results[0][0] > 0:
-                print(f"Successfully inserted {results[0][0]} chunks")
-                return True
-                
-            print(f"No chunks inserted. Attempt {attempt + 1}/{max_retries}")
-            
-        except Exception as e:
-            print(f"Error executing query on attempt {attempt + 1}: {str(e)}")
-            
+        if verify_files_in_stage(session, stage):
+            break
+        print(f"Files not yet available in stage. Attempt {attempt + 1}/{max_retries}")
         time.sleep(retry_delay)
-    
-    print("Failed to insert chunks after all retries")
-    return False
+    else:
+        print("Failed to insert chunks - stage is empty")
+        return False
+
+    if relative_paths is None:
+        relative_paths = list_stage_files(session, stage)
+
+    scheduler = IngestionScheduler(session, stage, table, profile.chunk_size, profile.chunk_overlap,
+                                   max_retries=max_retries, retry_delay=retry_delay, **INGESTION_CONFIG)
+    report = scheduler.run(relative_paths)
+    return len(report["failed"]) == 0
+
+
+def texts_into_table(session, stage: str, table: str, texts: dict, profile: PipelineProfile = ACTIVE_PROFILE):
+    """Chunk locally extracted text, keyed by the relative path of its staged part, into table.
+
+    All texts are bulk loaded into a temporary table and chunked with a single insert.
+    Returns True when the insert succeeded.
+    """
+    print(f"inserting chunks of {len(texts)} locally extracted files from {stage}")
+    try:
+        with timer("ingestion.local_chunking"):
+            session.create_dataframe([[relative_path, text] for relative_path, text in texts.items()],
+                                     schema=["RELATIVE_PATH", "PDF_TEXT"]) \
+                .write.save_as_table(LOCAL_TEXT_TABLE, mode="overwrite", table_type="temporary")
+            # The staged part supplies size and url; the text itself comes from the upload
+            source = (f"(select l.relative_path, l.pdf_text, d.size, d.file_url from {LOCAL_TEXT_TABLE} l "
+                      f"left join directory(@{stage}) d on d.relative_path = l.relative_path)")
+            results = session.sql(insert_chunks_sql(table, stage, source, "pdf_text",
+                                                    profile.chunk_size, profile.chunk_overlap)).collect()
+        inserted = results[0][0] if results and results[0] else 0
+        increment("ingestion.chunks", inserted)
+        print(f"Inserted {inserted} chunks of locally extracted text")
+        return True
+    except Exception as e:
+        print(f"Error inserting locally extracted text: {str(e)}")
+        return False
+
+
+def parts_into_table(session, stage: str, table: str, parts: List[dict], profile: PipelineProfile = ACTIVE_PROFILE):
+    """Chunk uploaded parts into table: local text directly, the rest through PARSE_DOCUMENT.
+
+    Returns True when all parts were ingested.
+    """
+    texts = {part["relative_path"]: part["text"] for part in parts if part["text"] is not None}
+    to_parse = [part["relative_path"] for part in parts if part["text"] is None]
+    succeeded = True
+    if texts:
+        succeeded = texts_into_table(session, stage, table, texts, profile)
+    if to_parse:
+        succeeded = chunks_into_table(session, stage, table, to_parse, profile=profile) and succeeded
+    return succeeded
 
 
 def refresh_stage(session, stage: str):
@@ -127,15 +190,20 @@ def refresh_stage(session, stage: str):
 
 
 if __name__ == "__main__":
-    cur_session = init_connection_and_db()
-    if not os.path.exists(split_files_dir_path):
-        os.makedirs(split_files_dir_path)
-
-    for file_name in os.listdir(documents_dir_path):
-        print(f"starting to process {file_name}")
-        file_path = os.path.join(documents_dir_path, file_name)
-        upload_file_to_stage(cur_session, file_path, VERIFIED_DOCUMENT_STAGE)
-
-    # Refresh the stage before processing chunks
-    refresh_stage(cur_session, VERIFIED_DOCUMENT_STAGE)
-    chunks_into_table(cur_session, VERIFIED_DOCUMENT_STAGE, VERIFIED_DOCS_CHUNKS)
+    session_pool = init_connection_and_db()
+
+    with session_pool.session("ingestion") as cur_session:
+        parts = []
+        for file_name in os.listdir(documents_dir_path):
+            print(f"starting to process {file_name}")
+            file_path = os.path.join(documents_dir_path, file_name)
+            parts.extend(upload_file_to_stage(cur_session, file_path, VERIFIED_DOCUMENT_STAGE))
+
+        # Refresh the stage before processing chunks
+        refresh_stage(cur_session, VERIFIED_DOCUMENT_STAGE)
+        parts_into_table(cur_session, VERIFIED_DOCUMENT_STAGE, VERIFIED_DOCS_CHUNKS, parts)
+        # Index claims of every verified chunk that doesn't have them yet, including older ingestions
+        build_claim_index(cur_session, model=ACTIVE_PROFILE.model)
+    session_pool.close()
+    print_metrics("pool.")
+    print_metrics("ingestion.")
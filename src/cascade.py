@@ -0,0 +1,103 @@
+import json
+import time
+
+from src import cortex
+from src.metrics import get_metrics, increment
+from src.profiles import PipelineProfile
+
+VERDICTS = ("verified", "contradicted", "unverified")
+
+# Seconds per large-model answer, used until one has been timed in this process
+DEFAULT_LARGE_MODEL_LATENCY = 3.0
+
+FIRST_PASS_VERDICT_PROMPT = """
+    You verify statements using only the CONTEXT provided.
+    Answer "verified" if the context supports the statement, "contradicted" if the context contradicts it,
+    and "unverified" if the context does not say.
+    Reply with JSON only, in exactly this shape: {{"verdict": "verified|contradicted|unverified", "confidence": 0.0-1.0}}
+    <statement>{statement}</statement>
+    <context>{context}</context>
+    """
+
+
+class ModelCascade:
+    """Answer with the profile's small model first and escalate to its large model when needed.
+
+    Keeps per-run statistics so the caller can report the escalation rate and the latency and
+    credits saved compared to sending everything to the large model.
+    """
+
+    def __init__(self, profile: PipelineProfile):
+        self.profile = profile
+        self.stats = {"first_pass": 0, "escalated": 0, "small_time": 0.0, "large_time": 0.0,
+                      "small_tokens": 0, "large_tokens": 0, "extraction_escalations": 0}
+
+    def complete(self, session, small_prompt: str, large_prompt: str, parse) -> str:
+        """Return parse(small answer), or the large model's answer when parse returns None."""
+        start = time.monotonic()
+        text, tokens = cortex.complete_with_usage(session, self.profile.small_model, small_prompt)
+        self.stats["small_time"] += time.monotonic() - start
+        self.stats["small_tokens"] += tokens
+
+        answer = parse(text)
+        if answer is not None:
+            self.stats["first_pass"] += 1
+            increment("cascade.first_pass")
+            return answer
+
+        print(f"Escalating to {self.profile.model}, first pass answered: {text}")
+        start = time.monotonic()
+        text, tokens = cortex.complete_with_usage(session, self.profile.model, large_prompt)
+        self.stats["large_time"] += time.monotonic() - start
+        self.stats["large_tokens"] += tokens
+        self.stats["escalated"] += 1
+        increment("cascade.escalated")
+        return text
+
+    def verdict(self, session, statement: str, context, large_prompt: str) -> str:
+        small_prompt = FIRST_PASS_VERDICT_PROMPT.format(statement=statement, context=context)
+        return self.complete(session, small_prompt, large_prompt, self.parse_verdict).strip()
+
+    def parse_verdict(self, text: str):
+        """Accept a first-pass verdict only if it is well-formed, confident and doesn't reject the document."""
+        text = text.strip()
+        if text.startswith('```json'):
+            text = text[7:]
+        if text.endswith('```'):
+            text = text[:-3]
+        try:
+            answer = json.loads(text.strip())
+            verdict = str(answer["verdict"]).strip().lower()
+            confidence = float(answer["confidence"])
+        except (ValueError, KeyError, TypeError):
+            return None
+        if verdict not in VERDICTS or confidence < self.profile.escalation_confidence:
+            return None
+        if verdict != "verified" and self.profile.escalate_rejections:
+            return None
+        return verdict
+
+    def large_model_latency(self) -> float:
+        """Average latency of the large model: this run's escalations, else any timed call in the process."""
+        if self.stats["escalated"]:
+            return self.stats["large_time"] / self.stats["escalated"]
+        timing = get_metrics("cortex.complete_latency.")["timings"].get(f"cortex.complete_latency.{self.profile.model}")
+        return timing["avg"] if timing else DEFAULT_LARGE_MODEL_LATENCY
+
+    def report(self) -> dict:
+        """Escalation rate and estimated savings versus answering everything with the large model."""
+        decisions = self.stats["first_pass"] + self.stats["escalated"]
+        if decisions == 0:
+            return None
+        actual_credits = (cortex.estimate_credits(self.profile.small_model, self.stats["small_tokens"]) +
+                          cortex.estimate_credits(self.profile.model, self.stats["large_tokens"]))
+        # Every decision made one small call with a prompt of about the same size as the large one
+        baseline_credits = cortex.estimate_credits(self.profile.model, self.stats["small_tokens"])
+        latency_saved = decisions * self.large_model_latency() - (self.stats["small_time"] + self.stats["large_time"])
+        return {
+            "decisions": decisions,
+            "escalation_rate": self.stats["escalated"] / decisions,
+            "latency_saved": latency_saved,
+            "credits_saved": baseline_credits - actual_credits,
+            "extraction_escalations": self.stats["extraction_escalations"],
+        }
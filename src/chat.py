@@ -1,21 +1,24 @@
 import json
 
-from src.database import VERIFIED_DOCUMENT_STAGE
-
-NUM_CHUNKS = 3  # Num-chunks provided as context. Play with this to check how it affects your accuracy
+from src import cortex
+from src.cascade import ModelCascade
+from src.database import VERIFIED_DOCUMENT_STAGE, get_css
+from src.metadata import era_filter
+from src.profiles import ACTIVE_PROFILE
 
 # columns to query in the service
 COLUMNS = [
     "chunk",
     "relative_path",
+    "section",
 ]
 
 
 class Chat:
-    def __init__(self, streamlit, session, svc):
+    def __init__(self, streamlit, session_pool, profile=ACTIVE_PROFILE):
         self.st = streamlit
-        self.session = session
-        self.svc = svc
+        self.session_pool = session_pool
+        self.profile = profile
 
     def chat(self):
         if "messages" not in self.st.session_state:
@@ -47,7 +50,8 @@ class Chat:
 
             # Show assistant message with loading state
             with self.st.chat_message("assistant"):
-                with self.st.status("Thinking...", expanded=True) as status:
+                with self.st.status("Thinking...", expanded=True) as status, \
+                        self.session_pool.session("chat") as session:
                     print(f"Got prompt: {prompt}")
                     if len(self.st.session_state.messages) > 1:
                         status.write("Analyzing conversation context...")
@@ -59,18 +63,21 @@ class Chat:
                                        f"Don't include unnecessary information. Phrase as a new question. "
                                        f"<question> {prompt} </question>")
                         print(f"Rephrasing prompt: {rephrase_prompt}")
-                        cmd = """
-                           select snowflake.cortex.complete(?, ?) as response
-                        """
-                        df_response = self.session.sql(cmd, params=['mistral-large2', rephrase_prompt]).collect()
-                        rephrased_question = df_response[0].RESPONSE
+                        if self.profile.cascade:
+                            # Any short, non-empty rephrase from the small model is good enough
+                            rephrased_question = ModelCascade(self.profile).complete(
+                                session, rephrase_prompt, rephrase_prompt,
+                                lambda text: text.strip() if 0 < len(text.strip()) <= 1000 else None)
+                        else:
+                            rephrased_question = cortex.complete(session, self.profile.model, rephrase_prompt)
                         print(f"Rephrased question: {rephrased_question}")
                     else:
                         rephrased_question = prompt
 
                     status.write("Searching for relevant information...")
                     print("Querying cortex for context")
-                    query_context = self.svc.search(prompt, COLUMNS, limit=NUM_CHUNKS)
+                    query_context = cortex.search(get_css(session), prompt, COLUMNS, self.profile.num_chunks,
+                                                  filter=era_filter(rephrased_question), session=session)
                     print(f"Got context: {query_context}")
 
                     prompt = f"""
@@ -97,23 +104,18 @@ class Chat:
                     print(f"Going to ask LLM the question. Relative paths: {relative_paths}")
                     
                     status.write("Generating response...")
-                    cmd = """
-                       select snowflake.cortex.complete(?, ?) as response
-                    """
-
-                    df_response = self.session.sql(cmd, params=['mistral-large2', prompt]).collect()
+                    rs_text = cortex.complete(session, self.profile.model, prompt)
 
                     # Update related documents
                     self.st.session_state.related_documents = []
                     if relative_paths != "None":
                         for path in relative_paths:
                             cmd2 = f"select GET_PRESIGNED_URL(@{VERIFIED_DOCUMENT_STAGE}, '{path}', 360) as URL_LINK from directory(@{VERIFIED_DOCUMENT_STAGE})"
-                            df_url_link = self.session.sql(cmd2).to_pandas()
+                            df_url_link = session.sql(cmd2).to_pandas()
                             url_link = df_url_link._get_value(0, 'URL_LINK')
                             display_url = f"Doc: [{path}]({url_link})"
                             self.st.session_state.related_documents.append(display_url)
 
-                    rs_text = df_response[0].RESPONSE
                     print(f"Got response: {rs_text}")
                     self.st.session_state.messages.append({"role": "assistant", "content": rs_text})
                     self.st.markdown(rs_text)
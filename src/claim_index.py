@@ -0,0 +1,115 @@
+import re
+import time
+
+from src.cortex import GOVERNOR
+from src.database import UNVERIFIED_DOCS_CHUNKS, VERIFIED_CLAIMS, VERIFIED_DOCS_CHUNKS
+from src.metrics import increment, record_timing
+from src.profiles import ACTIVE_PROFILE
+
+EMBEDDING_MODEL = "snowflake-arctic-embed-m-v1.5"
+CLAIM_EXTRACTION_PROMPT = ("Return a json formatted list of statements documented in the text. "
+                           "Return only the list with no additional information.")
+
+# Only near-paraphrases of a verified claim may skip the LLM
+CLAIM_MATCH_THRESHOLD = 0.95
+
+NUMBER_PATTERN = re.compile(r"\d+(?:[.,]\d+)*")
+NEGATION_PATTERN = re.compile(r"\b(not|no|never|none|neither|nor|without)\b|n't\b", re.IGNORECASE)
+
+
+def build_claim_index(session, relative_paths: list = None, model: str = ACTIVE_PROFILE.model):
+    """Extract claims from verified chunks that are not indexed yet, and embed them.
+
+    When relative_paths is given, only chunks of those files are considered. This runs COMPLETE
+    on every chunk, so it is meant for the bulk backfill; accepted documents reuse their
+    statements through index_extracted_statements.
+    """
+    path_filter = ""
+    params = []
+    if relative_paths:
+        path_filter = f"AND c.relative_path IN ({', '.join(['?'] * len(relative_paths))})"
+        params = list(relative_paths)
+    build_sql = (f"INSERT INTO {VERIFIED_CLAIMS} (claim, embedding, source_chunk_id, relative_path) "
+                 f"WITH extracted AS ("
+                 f"SELECT c.chunk_id, c.relative_path, "
+                 f"TRY_PARSE_JSON(TRIM(REPLACE(REPLACE(SNOWFLAKE.CORTEX.COMPLETE('{model}', "
+                 f"'{CLAIM_EXTRACTION_PROMPT} <text>' || c.chunk || '</text>'), '```json', ''), '```', ''))) AS claims "
+                 f"FROM {VERIFIED_DOCS_CHUNKS} c "
+                 f"WHERE c.chunk_id IS NOT NULL {path_filter} "
+                 f"AND NOT EXISTS (SELECT 1 FROM {VERIFIED_CLAIMS} v WHERE v.source_chunk_id = c.chunk_id)) "
+                 f"SELECT f.value::STRING, SNOWFLAKE.CORTEX.EMBED_TEXT_768('{EMBEDDING_MODEL}', f.value::STRING), "
+                 f"e.chunk_id, e.relative_path "
+                 f"FROM extracted e, LATERAL FLATTEN(input => e.claims) f "
+                 f"WHERE IS_VARCHAR(f.value)")
+    print(build_sql)
+    results = GOVERNOR.call("COMPLETE", lambda: session.sql(build_sql, params=params).collect(), model)
+    inserted = results[0][0] if results and results[0] else 0
+    print(f"Indexed {inserted} verified claims")
+    return inserted
+
+
+def index_extracted_statements(session, relative_paths: list, statements_table: str = UNVERIFIED_DOCS_CHUNKS):
+    """Index the statements already extracted for a verified document, without another COMPLETE.
+
+    Verification stores each chunk's statements in statements_table, using the same prompt as
+    build_claim_index. They are matched to the verified chunks on CHUNK_ID; chunks without a
+    match are left to the next build_claim_index backfill.
+    """
+    placeholders = ", ".join(["?"] * len(relative_paths))
+    index_sql = (f"INSERT INTO {VERIFIED_CLAIMS} (claim, embedding, source_chunk_id, relative_path) "
+                 f"WITH extracted AS ("
+                 f"SELECT DISTINCT v.chunk_id, v.relative_path, "
+                 f"TRY_PARSE_JSON(TRIM(REPLACE(REPLACE(s.statements, '```json', ''), '```', ''))) AS claims "
+                 f"FROM {statements_table} s JOIN {VERIFIED_DOCS_CHUNKS} v ON v.chunk_id = s.chunk_id "
+                 f"WHERE v.relative_path IN ({placeholders}) "
+                 f"AND NOT EXISTS (SELECT 1 FROM {VERIFIED_CLAIMS} c WHERE c.source_chunk_id = v.chunk_id)) "
+                 f"SELECT f.value::STRING, SNOWFLAKE.CORTEX.EMBED_TEXT_768('{EMBEDDING_MODEL}', f.value::STRING), "
+                 f"e.chunk_id, e.relative_path "
+                 f"FROM extracted e, LATERAL FLATTEN(input => e.claims) f "
+                 f"WHERE IS_VARCHAR(f.value)")
+    print(index_sql)
+    results = GOVERNOR.call("EMBED", lambda: session.sql(index_sql, params=list(relative_paths)).collect(),
+                            EMBEDDING_MODEL)
+    inserted = results[0][0] if results and results[0] else 0
+    print(f"Indexed {inserted} verified claims from extracted statements")
+    return inserted
+
+
+def match_claim(session, statement: str):
+    """Return the closest verified claim if it is close enough to decide the statement on its own.
+
+    Embedding similarity can't tell "1941" from "1942" or "did" from "did not", so a match also
+    needs the same numbers and the same negation as the statement.
+    """
+    start = time.monotonic()
+    match_sql = (f"WITH q AS (SELECT SNOWFLAKE.CORTEX.EMBED_TEXT_768(?, ?) AS embedding) "
+                 f"SELECT c.claim, c.relative_path, ch.chunk, "
+                 f"VECTOR_COSINE_SIMILARITY(c.embedding, q.embedding) AS similarity "
+                 f"FROM {VERIFIED_CLAIMS} c CROSS JOIN q "
+                 f"LEFT JOIN {VERIFIED_DOCS_CHUNKS} ch ON ch.chunk_id = c.source_chunk_id "
+                 f"ORDER BY similarity DESC LIMIT 1")
+    try:
+        rows = GOVERNOR.call("EMBED", lambda: session.sql(match_sql, params=[EMBEDDING_MODEL, statement]).collect(),
+                             EMBEDDING_MODEL)
+    except Exception as e:
+        # The index is only an optimisation - fall back to the LLM
+        print(f"Error looking up verified claims: {str(e)}")
+        rows = []
+    record_timing("claims.lookup", time.monotonic() - start)
+
+    if rows and rows[0]["SIMILARITY"] >= CLAIM_MATCH_THRESHOLD and _same_facts(statement, rows[0]["CLAIM"]):
+        increment("claims.fast_path.hits")
+        return {
+            "claim": rows[0]["CLAIM"],
+            "similarity": rows[0]["SIMILARITY"],
+            "relative_path": rows[0]["RELATIVE_PATH"],
+            "chunk": rows[0]["CHUNK"] or rows[0]["CLAIM"],
+        }
+    increment("claims.fast_path.misses")
+    return None
+
+
+def _same_facts(statement: str, claim: str) -> bool:
+    numbers = lambda text: set(NUMBER_PATTERN.findall(text))
+    negated = lambda text: len(NEGATION_PATTERN.findall(text)) % 2 == 1
+    return numbers(statement) == numbers(claim) and negated(statement) == negated(claim)
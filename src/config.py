@@ -15,6 +15,81 @@ SNOWFLAKE_CONFIG = {
     "schema": os.getenv("SNOWFLAKE_SCHEMA", "PUBLIC")
 }
 
+# Snowpark session pool shared by all Streamlit users. The verification limit defaults to 1
+# because verifications share the unverified stage and table.
+SESSION_POOL_CONFIG = {
+    "max_size": int(os.getenv("SESSION_POOL_MAX_SIZE", "8")),
+    "workload_limits": {
+        "chat": int(os.getenv("SESSION_POOL_CHAT_LIMIT", "6")),
+        "verification": int(os.getenv("SESSION_POOL_VERIFICATION_LIMIT", "1")),
+        "ingestion": int(os.getenv("SESSION_POOL_INGESTION_LIMIT", "4")),
+    },
+    "health_check_interval": float(os.getenv("SESSION_POOL_HEALTH_CHECK_INTERVAL", "300")),
+    "max_age": float(os.getenv("SESSION_POOL_MAX_AGE", "10800")),
+    "checkout_timeout": float(os.getenv("SESSION_POOL_CHECKOUT_TIMEOUT", "60")),
+}
+
+# Asynchronous PARSE_DOCUMENT jobs - raise max_in_flight for larger warehouses
+INGESTION_CONFIG = {
+    "max_in_flight": int(os.getenv("INGESTION_MAX_IN_FLIGHT", "4")),
+    "batch_size": int(os.getenv("INGESTION_BATCH_SIZE", "1")),
+    "poll_interval": float(os.getenv("INGESTION_POLL_INTERVAL", "1")),
+    # Give up on the remaining files when no PARSE_DOCUMENT slot is granted for this long
+    "max_blocked_time": float(os.getenv("INGESTION_MAX_BLOCKED_TIME", "300")),
+}
+
+# Pages with a good embedded text layer are extracted locally instead of with PARSE_DOCUMENT.
+# A page qualifies with at least min_chars characters, of which min_word_ratio of the tokens are words.
+TEXT_LAYER_CONFIG = {
+    "enabled": os.getenv("TEXT_LAYER_FAST_PATH", "true").lower() in ("1", "true", "yes"),
+    "max_workers": int(os.getenv("TEXT_LAYER_MAX_WORKERS", str(min(os.cpu_count() or 1, 8)))),
+    "min_pages_per_worker": 20,
+    # Total size of in-memory document copies handed to extraction workers
+    "max_worker_bytes": int(os.getenv("TEXT_LAYER_MAX_WORKER_MB", "512")) * 1024 * 1024,
+    "min_chars": int(os.getenv("TEXT_LAYER_MIN_CHARS", "200")),
+    "min_word_ratio": float(os.getenv("TEXT_LAYER_MIN_WORD_RATIO", "0.7")),
+    # Fewer, larger parts: short runs of good pages are parsed with their neighbours, and a
+    # split window with more than max_bad_ratio bad pages is parsed as a whole
+    "min_run_pages": int(os.getenv("TEXT_LAYER_MIN_RUN_PAGES", "20")),
+    "max_bad_ratio": float(os.getenv("TEXT_LAYER_MAX_BAD_RATIO", "0.5")),
+}
+
+# Freshly promoted chunks stay searchable from memory until the search service (target lag
+# 1 minute) has indexed them. min_score is the share of query terms a chunk must contain.
+FRESHNESS_CONFIG = {
+    "check_interval": float(os.getenv("FRESHNESS_CHECK_INTERVAL", "5")),
+    "max_age": float(os.getenv("FRESHNESS_MAX_AGE", "600")),
+    "min_score": float(os.getenv("FRESHNESS_MIN_SCORE", "0.5")),
+    "poll_interval": 5,
+}
+
+# Client-side limits for Cortex calls. Rates are (tokens per second, burst) and concurrency is
+# (initial, min, max) for the adaptive limiter. Raise them if your account allows more.
+CORTEX_GOVERNOR_CONFIG = {
+    "function_rates": {
+        "COMPLETE": (float(os.getenv("CORTEX_COMPLETE_RATE", "10")), 20),
+        "SEARCH": (float(os.getenv("CORTEX_SEARCH_RATE", "20")), 40),
+        "PARSE_DOCUMENT": (float(os.getenv("CORTEX_PARSE_DOCUMENT_RATE", "2")), 4),
+        "EMBED": (float(os.getenv("CORTEX_EMBED_RATE", "20")), 40),
+    },
+    "model_rates": {
+        "mistral-large2": (float(os.getenv("CORTEX_MISTRAL_LARGE2_RATE", "5")), 10),
+    },
+    "concurrency": {
+        "default": (4, 1, 16),
+        "COMPLETE": (8, 1, 32),
+        "SEARCH": (8, 1, 32),
+        "PARSE_DOCUMENT": (4, 1, 16),
+        "EMBED": (8, 1, 32),
+    },
+    "max_retries": int(os.getenv("CORTEX_MAX_RETRIES", "5")),
+    "backoff_base": 0.5,
+    "backoff_cap": 30,
+    "failure_threshold": 5,
+    "reset_timeout": 30,
+    "acquire_timeout": 120,
+}
+
 # Validate required configuration
 required_configs = [
     "account", "user", "password", "role", "warehouse"
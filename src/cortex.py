@@ -0,0 +1,307 @@
+import json
+import random
+import threading
+import time
+
+from src.config import CORTEX_GOVERNOR_CONFIG
+from src.freshness import OVERLAY
+from src.metrics import increment, record_timing, set_gauge
+
+# Approximate Cortex COMPLETE credits per million tokens, for cost estimates only
+MODEL_CREDITS_PER_MILLION_TOKENS = {
+    "mistral-large2": 1.95,
+    "llama3.1-70b": 1.21,
+    "mixtral-8x7b": 0.22,
+    "llama3.1-8b": 0.19,
+    "mistral-7b": 0.12,
+}
+
+THROTTLING_MARKERS = ["429", "too many requests", "rate limit", "throttl", "concurrency limit"]
+TRANSIENT_MARKERS = ["timeout", "timed out", "502", "503", "504", "temporarily", "connection", "try again",
+                     "internal error"]
+
+
+class CircuitOpenError(Exception):
+    """Raised when calls to a Cortex function are short-circuited after repeated failures."""
+
+
+def is_throttling_error(error: Exception) -> bool:
+    message = str(error).lower()
+    return any(marker in message for marker in THROTTLING_MARKERS)
+
+
+def is_transient_error(error: Exception) -> bool:
+    message = str(error).lower()
+    return is_throttling_error(error) or any(marker in message for marker in TRANSIENT_MARKERS)
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, up to `burst` saved up."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: float = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+class AdaptiveLimiter:
+    """Concurrency limit that grows additively on success and halves on throttling (AIMD)."""
+
+    def __init__(self, name: str, initial: int, minimum: int, maximum: int):
+        self.name = name
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self._in_flight = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout: float = None) -> bool:
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._in_flight < self.limit, timeout):
+                return False
+            self._in_flight += 1
+            return True
+
+    def cancel(self):
+        """Give back a slot that was never used, without counting it as an outcome."""
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def release(self, throttled: bool = False):
+        with self._cond:
+            self._in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit // 2)
+                self._successes = 0
+                print(f"Cortex {self.name} throttled, concurrency limit lowered to {self.limit}")
+            else:
+                self._successes += 1
+                # One step up per full window of successes
+                if self._successes >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self._successes = 0
+            set_gauge(f"cortex.concurrency_limit.{self.name}", self.limit)
+            self._cond.notify_all()
+
+
+class CircuitBreaker:
+    """Stops calling a function after repeated failures, then lets a single probe call through."""
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    print(f"Circuit for Cortex {self.name} opened after {self._failures} failures")
+                    increment(f"cortex.circuit_opened.{self.name}")
+                self._opened_at = time.monotonic()
+
+
+class CortexGovernor:
+    """Client-side governor shared by every Cortex call (COMPLETE, SEARCH, PARSE_DOCUMENT).
+
+    A call must get a token from its function's bucket and its model's bucket, a slot from the
+    function's adaptive concurrency limit, and pass the function's circuit breaker. Throttling
+    and transient errors are retried with jittered exponential backoff.
+    """
+
+    def __init__(self, function_rates: dict, model_rates: dict, concurrency: dict, max_retries: int,
+                 backoff_base: float, backoff_cap: float, failure_threshold: int, reset_timeout: float,
+                 acquire_timeout: float):
+        self.function_rates = function_rates
+        self.model_rates = model_rates
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.acquire_timeout = acquire_timeout
+        self._buckets = {}
+        self._limiters = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def call(self, function: str, fn, model: str = None):
+        """Run fn() under the limits of the given Cortex function and model."""
+        for attempt in range(1, self.max_retries + 1):
+            if not self.acquire(function, model, self.acquire_timeout):
+                raise CircuitOpenError(f"Cortex {function} is unavailable (circuit open or rate limit wait exceeded)")
+            start = time.monotonic()
+            try:
+                result = fn()
+            except Exception as e:
+                self.release(function, e)
+                if not is_transient_error(e) or attempt == self.max_retries:
+                    raise
+                delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+                print(f"Cortex {function} failed on attempt {attempt}/{self.max_retries}, "
+                      f"retrying in {delay:.1f}s: {str(e)}")
+                increment(f"cortex.retries.{function}")
+                time.sleep(delay)
+                continue
+            self.release(function)
+            record_timing(f"cortex.{function}", time.monotonic() - start)
+            return result
+
+    def acquire(self, function: str, model: str = None, timeout: float = None) -> bool:
+        """Reserve a call slot. Every successful acquire must be followed by release()."""
+        buckets = [self._bucket(f"function.{function}", self.function_rates.get(function))]
+        if model:
+            buckets.append(self._bucket(f"model.{model}", self.model_rates.get(model)))
+        for bucket in buckets:
+            if bucket is not None and not bucket.acquire(timeout):
+                return False
+        limiter = self._limiter(function)
+        if not limiter.acquire(timeout):
+            return False
+        if not self._breaker(function).allow():
+            limiter.cancel()
+            increment(f"cortex.short_circuited.{function}")
+            return False
+        increment(f"cortex.calls.{function}")
+        return True
+
+    def release(self, function: str, error: Exception = None):
+        """Release a call slot, feeding the outcome back into the limiter and breaker."""
+        throttled = error is not None and is_throttling_error(error)
+        self._limiter(function).release(throttled)
+        if error is None:
+            self._breaker(function).record_success()
+            return
+        increment(f"cortex.errors.{function}")
+        if throttled:
+            increment(f"cortex.throttled.{function}")
+        if is_transient_error(error):
+            self._breaker(function).record_failure()
+        else:
+            # The service answered - the call itself was bad - so it is healthy, and a
+            # half-open probe must not leave the circuit open for good
+            self._breaker(function).record_success()
+
+    def _bucket(self, key: str, rate: tuple):
+        if rate is None:
+            return None
+        with self._lock:
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(*rate)
+            return self._buckets[key]
+
+    def _limiter(self, function: str) -> AdaptiveLimiter:
+        with self._lock:
+            if function not in self._limiters:
+                initial, minimum, maximum = self.concurrency.get(function, self.concurrency["default"])
+                self._limiters[function] = AdaptiveLimiter(function, initial, minimum, maximum)
+            return self._limiters[function]
+
+    def _breaker(self, function: str) -> CircuitBreaker:
+        with self._lock:
+            if function not in self._breakers:
+                self._breakers[function] = CircuitBreaker(function, self.failure_threshold, self.reset_timeout)
+            return self._breakers[function]
+
+
+# One governor per process, shared by every Streamlit session and the ingestion script
+GOVERNOR = CortexGovernor(**CORTEX_GOVERNOR_CONFIG)
+
+
+def complete(session, model: str, prompt: str) -> str:
+    """Run SNOWFLAKE.CORTEX.COMPLETE through the governor and return the response text."""
+    return complete_with_usage(session, model, prompt)[0]
+
+
+def complete_with_usage(session, model: str, prompt: str) -> tuple:
+    """Like complete(), but returns (response text, total tokens)."""
+    # The conversation form returns token usage alongside the answer
+    cmd = ("select snowflake.cortex.complete(?, "
+           "array_construct(object_construct('role', 'user', 'content', ?)), object_construct()) as response")
+    start = time.monotonic()
+    df_response = GOVERNOR.call("COMPLETE", lambda: session.sql(cmd, params=[model, prompt]).collect(), model)
+    # Per model, so the cascade can estimate what answering with the large model would cost
+    record_timing(f"cortex.complete_latency.{model}", time.monotonic() - start)
+    response = json.loads(df_response[0].RESPONSE)
+    tokens = response.get("usage", {}).get("total_tokens", 0)
+    record_llm_usage(model, 1, tokens)
+    return response["choices"][0]["messages"], tokens
+
+
+def estimate_credits(model: str, tokens: float) -> float:
+    return tokens / 1_000_000 * MODEL_CREDITS_PER_MILLION_TOKENS.get(model, 0)
+
+
+def record_llm_usage(model: str, calls: int, tokens: float):
+    """Account for LLM calls and tokens, e.g. for the profile sweep report."""
+    increment("cortex.llm_calls", calls)
+    increment(f"cortex.llm_calls.{model}", calls)
+    increment("cortex.tokens", tokens)
+    increment(f"cortex.tokens.{model}", tokens)
+
+
+def search(css, query: str, columns: list, limit: int, filter: dict = None, session=None):
+    """Query a Cortex Search service through the governor, optionally narrowed by a filter.
+
+    Chunks promoted since the service's last refresh are merged in from the freshness overlay;
+    pass a session so the overlay can evict the chunks the service has caught up with.
+    """
+    if session is not None:
+        OVERLAY.refresh(session)
+    if filter is None:
+        response = GOVERNOR.call("SEARCH", lambda: css.search(query, columns, limit=limit))
+        return OVERLAY.merge(response, query, columns, limit)
+
+    response = GOVERNOR.call("SEARCH", lambda: css.search(query, columns, filter=filter, limit=limit))
+    if len(response.results) < limit:
+        # Chunks without metadata never match a filter, so top up from the whole corpus
+        increment("cortex.search.filter_fallbacks")
+        fallback = GOVERNOR.call("SEARCH", lambda: css.search(query, columns, limit=limit))
+        seen = {(r.get("relative_path"), r.get("chunk")) for r in response.results}
+        extra = [r for r in fallback.results if (r.get("relative_path"), r.get("chunk")) not in seen]
+        response.results.extend(extra[:limit - len(response.results)])
+    return OVERLAY.merge(response, query, columns, limit, filter)
@@ -1,6 +1,7 @@
-from snowflake.core import Root
 from snowflake.snowpark import Session
-from src.config import SNOWFLAKE_CONFIG
+from src.config import SESSION_POOL_CONFIG, SNOWFLAKE_CONFIG
+from src.metrics import timed_import, timer
+from src.session_pool import SessionPool
 
 DATABASE = "HISTORICAL_FACTS_DB"
 SCHEMA = "PUBLIC"
@@ -10,57 +11,44 @@ UNVERIFIED_DOCS_SEARCH_SERVICE = "UNVERIFIED_DOCS_SEARCH_SERVICE"
 VERIFIED_DOCUMENT_STAGE = "VERIFIED_DOCUMENT_STAGE"
 UNVERIFIED_DOCUMENT_STAGE = "UNVERIFIED_DOCUMENT_STAGE"
 UNVERIFIED_DOCS_CHUNKS = "UNVERIFIED_DOCS_CHUNKS"
+VERIFIED_CLAIMS = "VERIFIED_CLAIMS"
+SCHEMA_VERSION_TABLE = "TRUTH_GUARD_SCHEMA_VERSION"
 
+# Chunk metadata derived from the split-file name (<document>_page_<start>-<end>.pdf) and the chunk text
+CHUNK_METADATA_COLUMNS = "source_document, page_start, page_end, section, era_start, era_end"
+SOURCE_DOCUMENT_SQL = "REGEXP_REPLACE(relative_path, '_page_[0-9]+-[0-9]+[.]pdf$', '.pdf')"
+PAGE_START_SQL = "TRY_TO_NUMBER(REGEXP_SUBSTR(relative_path, '_page_([0-9]+)-([0-9]+)[.]pdf$', 1, 1, 'e', 1))"
+PAGE_END_SQL = "TRY_TO_NUMBER(REGEXP_SUBSTR(relative_path, '_page_([0-9]+)-([0-9]+)[.]pdf$', 1, 1, 'e', 2))"
+ERA_START_SQL = "chunk_era({chunk})[0]::NUMBER"
+ERA_END_SQL = "chunk_era({chunk})[1]::NUMBER"
+CHUNK_ID_SQL = "SHA2(relative_path || ':' || {chunk})"
 
-def get_css(session):
-    """Get cortex search function."""
-    root = Root(session)
-    return root.databases[DATABASE].schemas[SCHEMA].cortex_search_services[VERIFIED_DOCS_SEARCH_SERVICE]
-
-
-def create_snowflake_session():
-    """Create and return a Snowflake session."""
-    return Session.builder.configs(SNOWFLAKE_CONFIG).create()
-
-
-def init_database(session):
-    """Initialize the database, schema, and required tables."""
-    statuses = []
-    # Create database and schema
-    statuses.append(session.sql(f"CREATE DATABASE IF NOT EXISTS {DATABASE}").collect())
-    statuses.append(session.sql(f"USE DATABASE {DATABASE}").collect())
-    statuses.append(session.sql(f"CREATE SCHEMA IF NOT EXISTS {SCHEMA}").collect())
-    statuses.append(session.sql(f"USE SCHEMA {SCHEMA}").collect())
-
-    # Create document stage if it doesn't exist
-    statuses.append(session.sql(f"""
-    CREATE STAGE IF NOT EXISTS {VERIFIED_DOCUMENT_STAGE}
-        FILE_FORMAT = (TYPE='CSV')
-        DIRECTORY = (ENABLE=TRUE)
-        ENCRYPTION=(TYPE='SNOWFLAKE_SSE')
-    """).collect())
-
-    # Create unverified document stage if it doesn't exist
-    statuses.append(session.sql(f"""
-    CREATE STAGE IF NOT EXISTS {UNVERIFIED_DOCUMENT_STAGE}
-        FILE_FORMAT = (TYPE='CSV')
-        DIRECTORY = (ENABLE=TRUE)
-        ENCRYPTION=(TYPE='SNOWFLAKE_SSE')
-    """).collect())
-
-    # Create verified chunks table
-    statuses.append(session.sql(f"""
-    CREATE TABLE IF NOT EXISTS {VERIFIED_DOCS_CHUNKS} ( 
-        RELATIVE_PATH VARCHAR(1000),
-        SIZE NUMBER(38,0),
-        FILE_URL VARCHAR(1000),
-        SCOPED_FILE_URL VARCHAR(1000),
-        CHUNK VARCHAR(16777216)
-    );
-    """).collect())
-
-    # Create unverified chunks table
-    statuses.append(session.sql(f"""
+# Ordered schema migrations as (version, description, statements). Never edit a released
+# migration - append a new one and the bootstrap will apply it on the next start.
+MIGRATIONS = [
+    (1, "initial schema", [
+        f"""
+        CREATE STAGE IF NOT EXISTS {VERIFIED_DOCUMENT_STAGE}
+            FILE_FORMAT = (TYPE='CSV')
+            DIRECTORY = (ENABLE=TRUE)
+            ENCRYPTION=(TYPE='SNOWFLAKE_SSE')
+        """,
+        f"""
+        CREATE STAGE IF NOT EXISTS {UNVERIFIED_DOCUMENT_STAGE}
+            FILE_FORMAT = (TYPE='CSV')
+            DIRECTORY = (ENABLE=TRUE)
+            ENCRYPTION=(TYPE='SNOWFLAKE_SSE')
+        """,
+        f"""
+        CREATE TABLE IF NOT EXISTS {VERIFIED_DOCS_CHUNKS} ( 
+            RELATIVE_PATH VARCHAR(1000),
+            SIZE NUMBER(38,0),
+            FILE_URL VARCHAR(1000),
+            SCOPED_FILE_URL VARCHAR(1000),
+            CHUNK VARCHAR(16777216)
+        );
+        """,
+        f"""
         CREATE TABLE IF NOT EXISTS {UNVERIFIED_DOCS_CHUNKS} (
             ID NUMBER(38,0) AUTOINCREMENT,
             RELATIVE_PATH VARCHAR(1000),
@@ -70,18 +58,9 @@ def init_database(session):
             CHUNK VARCHAR(16777216),
             STATEMENTS VARCHAR(16777216)
         );
-            """).collect())
-
-    # cleanup unverified stage and table - TODO: work only on our file and not delete everything
-    docs = session.sql(f"list @{UNVERIFIED_DOCUMENT_STAGE}").collect()
-    for doc in docs:
-        print(f"Removing {doc.name}")
-        session.sql(f"remove @{doc.name}").collect()
-    session.sql(f"delete from {UNVERIFIED_DOCS_CHUNKS}").collect()
-
-    # TODO: maybe we have to think about the check sizes and the overlap, and maybe define another chunker for the unverified documents
-    # Create text chunker for verified documents
-    statuses.append(session.sql(f"""
+        """,
+        # TODO: maybe we have to think about the check sizes and the overlap, and maybe define another chunker for the unverified documents
+        """
     create or replace function text_chunker(pdf_text string)
 returns table (chunk varchar)
 language python
@@ -109,23 +88,285 @@ class text_chunker:
         
         yield from df.itertuples(index=False, name=None)
 $$;
-    """).collect())
-
-    # Create cortex search for verified chunks table
-    statuses.append(session.sql(f"""
-    CREATE CORTEX SEARCH SERVICE IF NOT EXISTS {VERIFIED_DOCS_SEARCH_SERVICE}
-    ON CHUNK
-    WAREHOUSE = COMPUTE_WH
-    TARGET_LAG = '1 minute'
-    AS (
-        SELECT CHUNK,
-            RELATIVE_PATH,
-            FILE_URL
-        FROM {VERIFIED_DOCS_CHUNKS}
-    );
-    """).collect())
-    print(statuses)
-    return all([all(["successfully" in stat['status'] or "succeeded" in stat["status"] for stat in status]) for status in statuses])
+        """,
+        f"""
+        CREATE CORTEX SEARCH SERVICE IF NOT EXISTS {VERIFIED_DOCS_SEARCH_SERVICE}
+        ON CHUNK
+        WAREHOUSE = COMPUTE_WH
+        TARGET_LAG = '1 minute'
+        AS (
+            SELECT CHUNK,
+                RELATIVE_PATH,
+                FILE_URL
+            FROM {VERIFIED_DOCS_CHUNKS}
+        );
+        """,
+    ]),
+    (2, "chunk metadata and filterable search attributes", [
+        f"""
+        ALTER TABLE {VERIFIED_DOCS_CHUNKS} ADD COLUMN IF NOT EXISTS
+            SOURCE_DOCUMENT VARCHAR(1000),
+            PAGE_START NUMBER(38,0),
+            PAGE_END NUMBER(38,0),
+            SECTION VARCHAR(1000),
+            ERA_START NUMBER(38,0),
+            ERA_END NUMBER(38,0)
+        """,
+        f"""
+        ALTER TABLE {UNVERIFIED_DOCS_CHUNKS} ADD COLUMN IF NOT EXISTS
+            SOURCE_DOCUMENT VARCHAR(1000),
+            PAGE_START NUMBER(38,0),
+            PAGE_END NUMBER(38,0),
+            SECTION VARCHAR(1000),
+            ERA_START NUMBER(38,0),
+            ERA_END NUMBER(38,0)
+        """,
+        # Keep the year pattern in sync with src/metadata.py
+        r"""
+    create or replace function chunk_era(chunk string)
+returns array
+language python
+runtime_version = '3.9'
+handler = 'chunk_era'
+as
+$$
+import re
+
+YEAR_PATTERN = re.compile(r"(?<!\d)(1[5-9]\d{2}|20\d{2})(?!\d)")
+
+def chunk_era(chunk):
+    years = [int(year) for year in YEAR_PATTERN.findall(chunk or "")]
+    if not years:
+        return None
+    return [min(years), max(years)]
+$$;
+        """,
+        r"""
+    create or replace function text_chunker(pdf_text string)
+returns table (chunk varchar, section varchar)
+language python
+runtime_version = '3.9'
+handler = 'text_chunker'
+packages = ('snowflake-snowpark-python', 'langchain')
+as
+$$
+import bisect
+import re
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+HEADING_PATTERN = re.compile(r"^#{1,6}\s+(.+)$", re.MULTILINE)
+
+class text_chunker:
+
+    def process(self, pdf_text: str):
+        
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size = 1024,
+            chunk_overlap  = 124, 
+            length_function = len
+        )
+    
+        chunks = text_splitter.split_text(pdf_text)
+
+        # LAYOUT mode returns markdown, so a chunk belongs to the last heading before it
+        headings = [(m.start(), m.group(1).strip()[:1000]) for m in HEADING_PATTERN.finditer(pdf_text)]
+        heading_starts = [start for start, _ in headings]
+        cursor = 0
+        for chunk in chunks:
+            position = pdf_text.find(chunk, cursor)
+            if position >= 0:
+                cursor = position
+            idx = bisect.bisect_right(heading_starts, cursor) - 1
+            yield (chunk, headings[idx][1] if idx >= 0 else None)
+$$;
+        """,
+        f"""
+        UPDATE {VERIFIED_DOCS_CHUNKS} SET
+            SOURCE_DOCUMENT = {SOURCE_DOCUMENT_SQL},
+            PAGE_START = {PAGE_START_SQL},
+            PAGE_END = {PAGE_END_SQL},
+            ERA_START = {ERA_START_SQL.format(chunk="chunk")},
+            ERA_END = {ERA_END_SQL.format(chunk="chunk")}
+        """,
+        f"""
+        CREATE OR REPLACE CORTEX SEARCH SERVICE {VERIFIED_DOCS_SEARCH_SERVICE}
+        ON CHUNK
+        ATTRIBUTES RELATIVE_PATH, SOURCE_DOCUMENT, SECTION, PAGE_START, PAGE_END, ERA_START, ERA_END
+        WAREHOUSE = COMPUTE_WH
+        TARGET_LAG = '1 minute'
+        AS (
+            SELECT CHUNK,
+                RELATIVE_PATH,
+                FILE_URL,
+                SOURCE_DOCUMENT,
+                SECTION,
+                PAGE_START,
+                PAGE_END,
+                ERA_START,
+                ERA_END
+            FROM {VERIFIED_DOCS_CHUNKS}
+        );
+        """,
+    ]),
+    (3, "chunk IDs and verified claims index", [
+        f"ALTER TABLE {VERIFIED_DOCS_CHUNKS} ADD COLUMN IF NOT EXISTS CHUNK_ID VARCHAR(64)",
+        f"ALTER TABLE {UNVERIFIED_DOCS_CHUNKS} ADD COLUMN IF NOT EXISTS CHUNK_ID VARCHAR(64)",
+        f"UPDATE {VERIFIED_DOCS_CHUNKS} SET CHUNK_ID = {CHUNK_ID_SQL.format(chunk='chunk')} WHERE CHUNK_ID IS NULL",
+        f"""
+        CREATE TABLE IF NOT EXISTS {VERIFIED_CLAIMS} (
+            CLAIM VARCHAR(16777216),
+            EMBEDDING VECTOR(FLOAT, 768),
+            SOURCE_CHUNK_ID VARCHAR(64),
+            RELATIVE_PATH VARCHAR(1000),
+            CREATED_AT TIMESTAMP_LTZ DEFAULT CURRENT_TIMESTAMP()
+        );
+        """,
+    ]),
+    (4, "text_chunker with configurable chunk size and overlap", [
+        r"""
+    create or replace function text_chunker(pdf_text string, chunk_size number, chunk_overlap number)
+returns table (chunk varchar, section varchar)
+language python
+runtime_version = '3.9'
+handler = 'text_chunker'
+packages = ('snowflake-snowpark-python', 'langchain')
+as
+$$
+import bisect
+import re
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+HEADING_PATTERN = re.compile(r"^#{1,6}\s+(.+)$", re.MULTILINE)
+
+class text_chunker:
+
+    def process(self, pdf_text: str, chunk_size: int, chunk_overlap: int):
+        
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size = int(chunk_size),
+            chunk_overlap  = int(chunk_overlap), 
+            length_function = len
+        )
+    
+        chunks = text_splitter.split_text(pdf_text)
+
+        # LAYOUT mode returns markdown, so a chunk belongs to the last heading before it
+        headings = [(m.start(), m.group(1).strip()[:1000]) for m in HEADING_PATTERN.finditer(pdf_text)]
+        heading_starts = [start for start, _ in headings]
+        cursor = 0
+        for chunk in chunks:
+            position = pdf_text.find(chunk, cursor)
+            if position >= 0:
+                cursor = position
+            idx = bisect.bisect_right(heading_starts, cursor) - 1
+            yield (chunk, headings[idx][1] if idx >= 0 else None)
+$$;
+        """,
+    ]),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_css(session):
+    """Get cortex search function."""
+    # snowflake.core is slow to import, so only pay for it once a page actually searches
+    root = timed_import("snowflake.core").Root(session)
+    return root.databases[DATABASE].schemas[SCHEMA].cortex_search_services[VERIFIED_DOCS_SEARCH_SERVICE]
+
+
+def create_snowflake_session():
+    """Create and return a Snowflake session."""
+    with timer("startup.create_session"):
+        return Session.builder.configs(SNOWFLAKE_CONFIG).create()
+
+
+def create_pooled_session():
+    """Create a session for the pool, pointed at our schema when it already exists."""
+    session = create_snowflake_session()
+    try:
+        session.sql(f"USE SCHEMA {DATABASE}.{SCHEMA}").collect()
+    except Exception as e:
+        # Not bootstrapped yet - init_database will create and select the schema
+        print(f"Schema {DATABASE}.{SCHEMA} not available yet: {str(e)}")
+    return session
+
+
+def create_session_pool():
+    """Create the Snowpark session pool shared by every page and user."""
+    return SessionPool(create_pooled_session, **SESSION_POOL_CONFIG)
+
+
+def get_schema_version(session):
+    """Return the schema version recorded in the database, or 0 if it was never bootstrapped."""
+    try:
+        rows = session.sql(f"SELECT MAX(VERSION) AS VERSION FROM {DATABASE}.{SCHEMA}.{SCHEMA_VERSION_TABLE}").collect()
+        return rows[0]["VERSION"] or 0
+    except Exception as e:
+        # Anything but a missing table (network, suspended warehouse) must not re-run every migration
+        if "does not exist" not in str(e).lower():
+            raise
+        print(f"Schema version not available, assuming a fresh database: {str(e)}")
+        return 0
+
+
+def reset_unverified_workspace(session, relative_paths: list):
+    """Remove leftover chunks of earlier runs on these staged files from the unverified table.
+
+    Other verifications (another user, a profile sweep) share the workspace, so only the given
+    files are touched; their staged copies are overwritten by the upload.
+    """
+    placeholders = ", ".join(["?"] * len(relative_paths))
+    session.sql(f"delete from {UNVERIFIED_DOCS_CHUNKS} where relative_path in ({placeholders})",
+                params=list(relative_paths)).collect()
+
+
+def init_database(session, current_version=None):
+    """Bring the database up to SCHEMA_VERSION, running only the pending migrations."""
+    with timer("startup.init_database"):
+        if current_version is None:
+            current_version = get_schema_version(session)
+        if current_version >= SCHEMA_VERSION:
+            print(f"Schema is up to date (version {current_version})")
+            session.sql(f"USE SCHEMA {DATABASE}.{SCHEMA}").collect()
+            return True
+
+        statuses = []
+        # Create database and schema
+        statuses.append(session.sql(f"CREATE DATABASE IF NOT EXISTS {DATABASE}").collect())
+        statuses.append(session.sql(f"USE DATABASE {DATABASE}").collect())
+        statuses.append(session.sql(f"CREATE SCHEMA IF NOT EXISTS {SCHEMA}").collect())
+        statuses.append(session.sql(f"USE SCHEMA {SCHEMA}").collect())
+        statuses.append(session.sql(f"""
+        CREATE TABLE IF NOT EXISTS {SCHEMA_VERSION_TABLE} (
+            VERSION NUMBER(38,0),
+            DESCRIPTION VARCHAR(1000),
+            APPLIED_AT TIMESTAMP_LTZ DEFAULT CURRENT_TIMESTAMP()
+        );
+        """).collect())
+
+        for version, description, statements in MIGRATIONS:
+            if version <= current_version:
+                continue
+            print(f"Applying schema migration {version}: {description}")
+            migration_statuses = [session.sql(statement).collect() for statement in statements]
+            print(migration_statuses)
+            if not _all_succeeded(migration_statuses):
+                print(f"Schema migration {version} failed")
+                return False
+            session.sql(f"INSERT INTO {SCHEMA_VERSION_TABLE} (VERSION, DESCRIPTION) VALUES (?, ?)",
+                        params=[version, description]).collect()
+            statuses.extend(migration_statuses)
+
+        print(statuses)
+        return _all_succeeded(statuses)
+
+
+def _all_succeeded(statuses):
+    # DML (e.g. backfills) reports row counts rather than a status - those failing would have raised
+    return all([all(["status" not in stat.asDict() or "successfully" in stat['status'] or "succeeded" in stat["status"]
+                     for stat in status]) for status in statuses])
 
 
 def verify_cortex_access(session):
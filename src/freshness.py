@@ -0,0 +1,164 @@
+import re
+import threading
+import time
+from datetime import timezone
+
+from src.config import FRESHNESS_CONFIG
+from src.database import VERIFIED_DOCS_CHUNKS, VERIFIED_DOCS_SEARCH_SERVICE
+from src.metrics import increment, set_gauge
+
+TERM_PATTERN = re.compile(r"[a-z0-9]{3,}")
+STOP_WORDS = {"the", "and", "for", "was", "were", "with", "that", "this", "from", "are", "what", "when", "who",
+              "did", "how", "which", "has", "have", "had", "not", "its", "into", "about"}
+
+
+def terms(text: str) -> set:
+    return {term for term in TERM_PATTERN.findall((text or "").lower()) if term not in STOP_WORDS}
+
+
+def matches_filter(row: dict, filter: dict) -> bool:
+    """Evaluate a Cortex Search filter (@and, @or, @not, @eq, @lte, @gte) against a chunk."""
+    if not filter:
+        return True
+    (operator, operand), = filter.items()
+    if operator == "@and":
+        return all(matches_filter(row, f) for f in operand)
+    if operator == "@or":
+        return any(matches_filter(row, f) for f in operand)
+    if operator == "@not":
+        return not matches_filter(row, operand)
+    (column, value), = operand.items()
+    actual = row.get(column)
+    if actual is None:
+        # Like the service, chunks without the attribute never match
+        return False
+    if operator == "@eq":
+        return actual == value
+    if operator == "@lte":
+        return actual <= value
+    if operator == "@gte":
+        return actual >= value
+    raise ValueError(f"Unsupported search filter operator {operator}")
+
+
+def service_data_timestamp(session):
+    """The time up to which the verified search service has indexed its source table."""
+    rows = session.sql(f"DESCRIBE CORTEX SEARCH SERVICE {VERIFIED_DOCS_SEARCH_SERVICE}").collect()
+    if not rows:
+        return None
+    return _as_utc({key.lower(): value for key, value in rows[0].asDict().items()}.get("data_timestamp"))
+
+
+def _as_utc(timestamp):
+    if timestamp is None or timestamp.tzinfo is not None:
+        return timestamp
+    return timestamp.replace(tzinfo=timezone.utc)
+
+
+class FreshnessOverlay:
+    """Recently promoted chunks, searchable until the Cortex Search service has indexed them.
+
+    The service refreshes with a target lag, so a newly accepted document is invisible to
+    search for up to a minute. Promotions add their chunks here, and cortex.search merges term
+    matches from them with the service results. Chunks are evicted once the service's
+    data_timestamp passes their promotion time, or after max_age as a safety net.
+    The overlay is per process, shared by every Streamlit session in it.
+    """
+
+    def __init__(self, check_interval: float = 5, max_age: float = 600, min_score: float = 0.5,
+                 poll_interval: float = 5):
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self.min_score = min_score
+        self.poll_interval = poll_interval
+        self.watermark = None  # server time of the latest promotion
+        self._entries = []
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, session, relative_paths: list):
+        """Add the chunks of freshly promoted files and return the promotion's watermark."""
+        placeholders = ", ".join(["?"] * len(relative_paths))
+        rows = session.sql(f"SELECT chunk, relative_path, section, era_start, era_end FROM {VERIFIED_DOCS_CHUNKS} "
+                           f"WHERE relative_path IN ({placeholders})", params=relative_paths).collect()
+        promoted_at = _as_utc(session.sql("SELECT CURRENT_TIMESTAMP()").collect()[0][0])
+        entries = []
+        for row in rows:
+            chunk = {key.lower(): value for key, value in row.asDict().items()}
+            entries.append({"chunk": chunk, "terms": terms(chunk["chunk"]), "promoted_at": promoted_at,
+                            "added": time.monotonic()})
+        with self._lock:
+            self._entries.extend(entries)
+            self.watermark = max(self.watermark, promoted_at) if self.watermark else promoted_at
+            set_gauge("freshness.pending_chunks", len(self._entries))
+        print(f"Added {len(entries)} freshly promoted chunks to the search overlay, watermark {promoted_at}")
+        return promoted_at
+
+    def search(self, query: str, columns: list, limit: int, filter: dict = None) -> list:
+        """Return up to limit pending chunks sharing at least min_score of the query's terms."""
+        query_terms = terms(query)
+        if not query_terms:
+            return []
+        with self._lock:
+            entries = list(self._entries)
+        scored = []
+        for entry in entries:
+            score = len(query_terms & entry["terms"]) / len(query_terms)
+            if score >= self.min_score and matches_filter(entry["chunk"], filter):
+                scored.append((score, entry["chunk"]))
+        scored.sort(key=lambda hit: hit[0], reverse=True)
+        return [{column: chunk.get(column) for column in columns} for _, chunk in scored[:limit]]
+
+    def refresh(self, session, force: bool = False):
+        """Evict the chunks the service has caught up with, checking at most every check_interval."""
+        with self._lock:
+            if not self._entries or (not force and time.monotonic() - self._last_check < self.check_interval):
+                return
+            self._last_check = time.monotonic()
+        try:
+            data_timestamp = service_data_timestamp(session)
+        except Exception as e:
+            print(f"Error checking search service freshness: {str(e)}")
+            data_timestamp = None
+        now = time.monotonic()
+        with self._lock:
+            before = len(self._entries)
+            self._entries = [entry for entry in self._entries
+                             if not (data_timestamp and data_timestamp >= entry["promoted_at"])
+                             and now - entry["added"] < self.max_age]
+            set_gauge("freshness.pending_chunks", len(self._entries))
+        if before != len(self._entries):
+            print(f"Search service caught up to {data_timestamp}, evicted {before - len(self._entries)} "
+                  f"chunks from the overlay")
+
+    def is_fresh(self, session, watermark=None) -> bool:
+        """Whether the service reflects the given promotion, by default the latest one."""
+        watermark = watermark or self.watermark
+        if watermark is None:
+            return True
+        data_timestamp = service_data_timestamp(session)
+        return data_timestamp is not None and data_timestamp >= watermark
+
+    def wait_until_fresh(self, session, watermark=None, timeout: float = 120) -> bool:
+        """Block until the service reflects the promotion, returning False on timeout."""
+        deadline = time.monotonic() + timeout
+        while not self.is_fresh(session, watermark):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(self.poll_interval)
+        self.refresh(session, force=True)
+        return True
+
+    def merge(self, response, query: str, columns: list, limit: int, filter: dict = None):
+        """Put pending overlay hits ahead of the service results, keeping at most limit results."""
+        hits = self.search(query, columns, limit, filter)
+        if not hits:
+            return response
+        increment("freshness.overlay_hits", len(hits))
+        seen = {(hit.get("relative_path"), hit.get("chunk")) for hit in hits}
+        rest = [r for r in response.results if (r.get("relative_path"), r.get("chunk")) not in seen]
+        response.results[:] = (hits + rest)[:limit]
+        return response
+
+
+OVERLAY = FreshnessOverlay(**FRESHNESS_CONFIG)
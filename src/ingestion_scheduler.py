@@ -0,0 +1,159 @@
+import time
+
+from src.cortex import GOVERNOR, is_throttling_error
+from src.database import (CHUNK_ID_SQL, CHUNK_METADATA_COLUMNS, ERA_END_SQL, ERA_START_SQL, PAGE_END_SQL, PAGE_START_SQL,
+                          SOURCE_DOCUMENT_SQL)
+from src.metrics import increment, record_timing
+
+
+def insert_chunks_sql(table: str, stage: str, source: str, text_sql: str, chunk_size: int, chunk_overlap: int) -> str:
+    """Build the insert of text_chunker chunks, with their metadata, from rows of source.
+
+    source must provide relative_path, size and file_url, and text_sql is the text to chunk.
+    """
+    return (f"insert into {table}"
+            f" (relative_path, size, file_url, scoped_file_url, chunk, chunk_id, {CHUNK_METADATA_COLUMNS}) "
+            f"select relative_path, size, file_url, "
+            f"build_scoped_file_url(@{stage}, relative_path) as scoped_file_url,  "
+            f"t.chunk as chunk, {CHUNK_ID_SQL.format(chunk='t.chunk')}, "
+            f"{SOURCE_DOCUMENT_SQL}, {PAGE_START_SQL}, {PAGE_END_SQL}, t.section, "
+            f"{ERA_START_SQL.format(chunk='t.chunk')}, {ERA_END_SQL.format(chunk='t.chunk')} "
+            f"from {source},  "
+            f"TABLE(text_chunker ({text_sql}, {chunk_size}, {chunk_overlap})) as t ")
+
+
+class IngestionScheduler:
+    """Parse and chunk staged files as asynchronous Snowpark jobs.
+
+    Every file (or batch of files) gets its own PARSE_DOCUMENT + text_chunker insert, submitted
+    with collect_nowait. Up to max_in_flight jobs run at once, so ingestion scales with the
+    warehouse, and a file that fails is retried on its own instead of re-running the corpus.
+    """
+
+    def __init__(self, session, stage: str, table: str, chunk_size: int, chunk_overlap: int,
+                 max_in_flight: int = 4, batch_size: int = 1, max_retries: int = 3, retry_delay: float = 10,
+                 poll_interval: float = 1, max_blocked_time: float = 300):
+        self.session = session
+        self.stage = stage
+        self.table = table
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.max_in_flight = max_in_flight
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.max_blocked_time = max_blocked_time
+
+    def chunking_sql(self, relative_paths: list) -> str:
+        placeholders = ", ".join(["?"] * len(relative_paths))
+        # The markdown itself, with real newlines, so text_chunker can find the section headings
+        parsed_text = (f"SNOWFLAKE.CORTEX.PARSE_DOCUMENT(@{self.stage},  "
+                       f"relative_path, {{'mode': 'LAYOUT'}}):content::VARCHAR")
+        return (insert_chunks_sql(self.table, self.stage, f"directory(@{self.stage})", parsed_text,
+                                  self.chunk_size, self.chunk_overlap) +
+                f"where relative_path in ({placeholders})")
+
+    def run(self, relative_paths: list) -> dict:
+        """Ingest the given staged files and return a per-file report."""
+        pending = [
+            {"files": relative_paths[i:i + self.batch_size], "attempt": 0, "not_before": 0}
+            for i in range(0, len(relative_paths), self.batch_size)
+        ]
+        in_flight = []
+        report = {"succeeded": {}, "failed": {}}
+        run_start = time.monotonic()
+        blocked_since = None
+
+        while pending or in_flight:
+            now = time.monotonic()
+            while len(in_flight) < self.max_in_flight:
+                ready = next((batch for batch in pending if batch["not_before"] <= now), None)
+                if ready is None:
+                    # Waiting out a retry delay is not being blocked
+                    blocked_since = None
+                    break
+                # Without a governor slot the batch waits for the next poll
+                if not GOVERNOR.acquire("PARSE_DOCUMENT", timeout=0):
+                    if not in_flight:
+                        blocked_since = blocked_since or now
+                    break
+                blocked_since = None
+                pending.remove(ready)
+                if self._submit(ready, pending, report):
+                    in_flight.append(ready)
+
+            if blocked_since is not None and now - blocked_since > self.max_blocked_time:
+                # Circuit open or limits exhausted for too long - give up instead of polling forever
+                error = f"circuit open: no PARSE_DOCUMENT slot for {self.max_blocked_time:.0f}s"
+                for batch in pending:
+                    for relative_path in batch["files"]:
+                        report["failed"][relative_path] = error
+                pending.clear()
+                break
+
+            time.sleep(self.poll_interval)
+
+            for batch in [batch for batch in in_flight if batch["job"].is_done()]:
+                in_flight.remove(batch)
+                self._collect(batch, pending, report)
+
+        elapsed = time.monotonic() - run_start
+        total_chunks = sum(report["succeeded"].values())
+        print(f"Ingested {len(report['succeeded'])} files ({total_chunks:.0f} chunks) in {elapsed:.1f}s, "
+              f"{len(report['failed'])} failed")
+        if elapsed > 0:
+            print(f"Throughput: {len(report['succeeded']) / elapsed * 60:.1f} files/min, "
+                  f"{total_chunks / elapsed:.1f} chunks/s")
+        for relative_path, error in report["failed"].items():
+            print(f"Failed to ingest {relative_path}: {error}")
+        return report
+
+    def _submit(self, batch: dict, pending: list, report: dict) -> bool:
+        """Start the batch's job, returning False when it could not be submitted."""
+        batch["attempt"] += 1
+        batch["started"] = time.monotonic()
+        print(f"Submitting {batch['files']} (attempt {batch['attempt']}/{self.max_retries})")
+        try:
+            batch["job"] = self.session.sql(self.chunking_sql(batch["files"]), params=batch["files"]).collect_nowait()
+        except Exception as e:
+            # e.g. a dropped connection - only this batch is retried, jobs in flight carry on
+            GOVERNOR.release("PARSE_DOCUMENT", e)
+            self._retry_or_fail(batch, pending, report, e)
+            return False
+        return True
+
+    def _collect(self, batch: dict, pending: list, report: dict):
+        elapsed = time.monotonic() - batch["started"]
+        try:
+            results = batch["job"].result()
+            inserted = results[0][0] if results and results[0] else 0
+        except Exception as e:
+            GOVERNOR.release("PARSE_DOCUMENT", e)
+            self._retry_or_fail(batch, pending, report, e)
+            return
+        GOVERNOR.release("PARSE_DOCUMENT")
+        if inserted <= 0:
+            self._retry_or_fail(batch, pending, report,
+                                Exception("no chunks inserted - file may not be visible in the stage directory yet"))
+            return
+
+        record_timing("ingestion.batch", elapsed)
+        increment("ingestion.chunks", inserted)
+        print(f"Ingested {batch['files']}: {inserted} chunks in {elapsed:.1f}s "
+              f"({inserted / elapsed if elapsed else inserted:.1f} chunks/s)")
+        # The insert count is per batch; spread it evenly for the per-file report
+        for relative_path in batch["files"]:
+            report["succeeded"][relative_path] = inserted / len(batch["files"])
+
+    def _retry_or_fail(self, batch: dict, pending: list, report: dict, e: Exception):
+        increment("ingestion.failed_attempts")
+        if batch["attempt"] < self.max_retries:
+            print(f"Error ingesting {batch['files']} on attempt {batch['attempt']}: {str(e)}")
+            # Throttled batches wait longer, on top of the governor backing off
+            delay = self.retry_delay * batch["attempt"] * (2 if is_throttling_error(e) else 1)
+            batch["not_before"] = time.monotonic() + delay
+            pending.append(batch)
+        else:
+            for relative_path in batch["files"]:
+                report["failed"][relative_path] = str(e)
@@ -0,0 +1,26 @@
+import re
+
+# Keep in sync with the chunk_era UDF in src/database.py
+YEAR_PATTERN = re.compile(r"(?<!\d)(1[5-9]\d{2}|20\d{2})(?!\d)")
+
+# Slack around a statement's years, so "ended in 1945" still matches a chunk covering 1939-1944
+ERA_MARGIN_YEARS = 2
+
+
+def extract_years(text: str) -> list:
+    """Return the years mentioned in the text."""
+    return [int(year) for year in YEAR_PATTERN.findall(text or "")]
+
+
+def era_filter(text: str, margin: int = ERA_MARGIN_YEARS):
+    """Build a Cortex Search filter for chunks whose era overlaps the years mentioned in the text.
+
+    Returns None when the text mentions no year, meaning the whole corpus should be searched.
+    """
+    years = extract_years(text)
+    if not years:
+        return None
+    return {"@and": [
+        {"@lte": {"era_start": max(years) + margin}},
+        {"@gte": {"era_end": min(years) - margin}},
+    ]}
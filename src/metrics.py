@@ -0,0 +1,78 @@
+import importlib
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_timings = {}
+_counters = {}
+_gauges = {}
+
+
+def record_timing(name: str, seconds: float):
+    """Record a single duration sample (in seconds) under the given name."""
+    with _lock:
+        _timings.setdefault(name, []).append(seconds)
+
+
+def increment(name: str, value: float = 1):
+    """Increment a counter."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name: str, value: float):
+    """Set a gauge to its latest value."""
+    with _lock:
+        _gauges[name] = value
+
+
+@contextmanager
+def timer(name: str):
+    """Time the wrapped block and record it under the given name."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(name, time.perf_counter() - start)
+
+
+def timed_import(module_name: str):
+    """Import a module, recording how long the import took.
+
+    Only the first, real import is recorded, so repeated calls don't hide its cost.
+    """
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    with timer(f"import.{module_name}"):
+        return importlib.import_module(module_name)
+
+
+def get_metrics(prefix: str = "") -> dict:
+    """Return a snapshot of all metrics whose name starts with prefix."""
+    with _lock:
+        timings = {
+            name: {
+                "count": len(samples),
+                "total": sum(samples),
+                "avg": sum(samples) / len(samples),
+                "max": max(samples),
+            }
+            for name, samples in _timings.items() if name.startswith(prefix) and samples
+        }
+        counters = {name: value for name, value in _counters.items() if name.startswith(prefix)}
+        gauges = {name: value for name, value in _gauges.items() if name.startswith(prefix)}
+    return {"timings": timings, "counters": counters, "gauges": gauges}
+
+
+def print_metrics(prefix: str = ""):
+    """Print a snapshot of the metrics to the terminal."""
+    metrics = get_metrics(prefix)
+    for name, stats in sorted(metrics["timings"].items()):
+        print(f"[metrics] {name}: count={stats['count']} avg={stats['avg'] * 1000:.1f}ms "
+              f"max={stats['max'] * 1000:.1f}ms total={stats['total'] * 1000:.1f}ms")
+    for name, value in sorted(metrics["counters"].items()):
+        print(f"[metrics] {name}: {value}")
+    for name, value in sorted(metrics["gauges"].items()):
+        print(f"[metrics] {name}: {value}")
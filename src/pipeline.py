@@ -0,0 +1,282 @@
+import json
+import time
+
+from initial_file_ingestion import copy_parts_between_stages, parts_into_table, refresh_stage, upload_file_to_stage
+from src import cortex
+from src.cascade import ModelCascade
+from src.chat import COLUMNS
+from src.claim_index import CLAIM_EXTRACTION_PROMPT, index_extracted_statements, match_claim
+from src.database import *
+from src.freshness import OVERLAY
+from src.metadata import era_filter
+from src.profiles import ACTIVE_PROFILE, PipelineProfile
+from src.verification_results import VerificationResults
+
+
+class VerificationPipeline:
+    """The document verification steps, without any UI.
+
+    VerifyDoc drives it step by step to show progress, and the profile sweep runs it end to end.
+    The session must stay the same for the whole run - chunks_statements is a temporary table.
+    """
+
+    def __init__(self, session, css, profile: PipelineProfile = ACTIVE_PROFILE, results: VerificationResults = None):
+        self.session = session
+        self.css = css
+        self.profile = profile
+        self.results = results if results is not None else VerificationResults()
+        self.counts = {"verified": 0, "contradicted": 0, "unverified": 0}
+        self.fast_path_stats = {"hits": 0, "misses": 0, "lookup_time": 0.0, "llm_time": 0.0}
+        self.cascade = ModelCascade(profile) if profile.cascade else None
+        self.watermark = None  # freshness watermark of the promotion, if the document was accepted
+        self.relative_paths = []  # this run's staged parts - the unverified workspace is shared
+
+    def upload(self, file) -> list:
+        """Upload the document, a path or an in-memory PDF, to the unverified stage and return its parts."""
+        parts = upload_file_to_stage(self.session, file, UNVERIFIED_DOCUMENT_STAGE, self.profile)
+        if not parts:
+            raise Exception("Error: Unable to upload the document")
+        self.relative_paths = [part["relative_path"] for part in parts]
+        reset_unverified_workspace(self.session, self.relative_paths)
+        if not refresh_stage(self.session, UNVERIFIED_DOCUMENT_STAGE):
+            raise Exception("Error: Unable to refresh stage after upload")
+        return parts
+
+    def own_rows(self) -> str:
+        """SQL condition selecting this run's rows of the shared unverified table."""
+        # Inlined as literals because some of the statements carry prompts with '?' in them
+        literals = ["'" + path.replace("\\", "\\\\").replace("'", "\\'") + "'" for path in self.relative_paths]
+        return f"relative_path IN ({', '.join(literals)})"
+
+    def chunk(self, parts: list):
+        if not parts_into_table(self.session, UNVERIFIED_DOCUMENT_STAGE, UNVERIFIED_DOCS_CHUNKS, parts, self.profile):
+            raise Exception("Error: Unable to chunk the document")
+
+    def create_statements(self):
+        # With the cascade, the small model extracts first and malformed lists are redone below
+        model = self.profile.small_model if self.cascade else self.profile.model
+        create_statements_sql = ("CREATE OR REPLACE TEMPORARY TABLE chunks_statements AS "
+                                 "WITH unique_statement AS "
+                                 f"(SELECT DISTINCT id, relative_path, chunk FROM {UNVERIFIED_DOCS_CHUNKS} WHERE {self.own_rows()}), "
+                                 "chunks_statements AS (SELECT id, relative_path, "
+                                 f"TRIM(snowflake.cortex.COMPLETE ('{model}', "
+                                 f"'{CLAIM_EXTRACTION_PROMPT}"
+                                 " <text>' || chunk || '</text>'), "
+                                 "'\n') AS statements "
+                                 "FROM unique_statement) "
+                                 "SELECT * FROM chunks_statements;"
+                                 )
+        print(create_statements_sql)
+        cortex.GOVERNOR.call("COMPLETE", lambda: self.session.sql(create_statements_sql).collect(), model)
+        update_table_sql = (f"update {UNVERIFIED_DOCS_CHUNKS}  "
+                            f"SET statements = chunks_statements.statements "
+                            f"from chunks_statements "
+                            f"where  {UNVERIFIED_DOCS_CHUNKS}.id = chunks_statements.id;")
+        print(update_table_sql)
+        self.session.sql(update_table_sql).collect()
+
+        # One COMPLETE per chunk, ran inside SQL - estimate the tokens at ~4 characters each
+        usage = self.session.sql(f"SELECT COUNT(*) AS CALLS, "
+                                 f"SUM(LENGTH(chunk) + LENGTH(statements)) AS CHARS "
+                                 f"FROM {UNVERIFIED_DOCS_CHUNKS} WHERE {self.own_rows()}").collect()[0]
+        cortex.record_llm_usage(model, usage["CALLS"], (usage["CHARS"] or 0) / 4)
+
+        if self.cascade:
+            self.escalate_statements((usage["CHARS"] or 0) / usage["CALLS"] if usage["CALLS"] else 0)
+
+    def escalate_statements(self, avg_chars: float):
+        """Redo, with the large model, the chunks whose first-pass statements are not a JSON list."""
+        escalate_sql = (f"UPDATE {UNVERIFIED_DOCS_CHUNKS} "
+                        f"SET statements = TRIM(snowflake.cortex.COMPLETE ('{self.profile.model}', "
+                        f"'{CLAIM_EXTRACTION_PROMPT}"
+                        " <text>' || chunk || '</text>'), "
+                        "'\n') "
+                        f"WHERE {self.own_rows()} AND (statements IS NULL OR NOT COALESCE(IS_ARRAY(TRY_PARSE_JSON("
+                        "TRIM(REPLACE(REPLACE(statements, '```json', ''), '```', '')))), FALSE))")
+        print(escalate_sql)
+        results = cortex.GOVERNOR.call("COMPLETE", lambda: self.session.sql(escalate_sql).collect(), self.profile.model)
+        escalated = results[0][0] if results and results[0] else 0
+        print(f"Escalated statement extraction of {escalated} chunks to {self.profile.model}")
+        self.cascade.stats["extraction_escalations"] += escalated
+        cortex.record_llm_usage(self.profile.model, escalated, escalated * avg_chars / 4)
+
+    def verify_statement(self, statement):
+        # Fast path: the statement restates a claim already in the verified corpus
+        lookup_start = time.monotonic()
+        match = match_claim(self.session, statement)
+        self.fast_path_stats["lookup_time"] += time.monotonic() - lookup_start
+        if match:
+            print(f"Statement matches verified claim ({match['similarity']:.3f}): {match['claim']}")
+            self.fast_path_stats["hits"] += 1
+            return {
+                'result': "verified",
+                'context': [{'relative_path': match['relative_path'], 'chunk': match['chunk']}]
+            }
+
+        llm_start = time.monotonic()
+        result = self._verify_statement_with_llm(statement)
+        self.fast_path_stats["misses"] += 1
+        self.fast_path_stats["llm_time"] += time.monotonic() - llm_start
+        return result
+
+    def _verify_statement_with_llm(self, statement):
+        print(f"Finding context for statement: {statement}")
+        # Narrow retrieval to the era the statement talks about
+        search_results = cortex.search(self.css, statement, COLUMNS, self.profile.num_chunks,
+                                       filter=era_filter(statement), session=self.session)
+        print(f"Context for statement: {search_results}")
+
+        # Extract the results from the search_results
+        if hasattr(search_results, 'results'):
+            context_list = search_results.results
+        else:
+            # If search_results is already a list
+            context_list = search_results
+
+        verify_prompt = f"""
+            You are an expert chat assistance that verifies statements using the CONTEXT provided.
+            If the statement is supported by the context, please answer "verified". If the statement is contradicted by the context, please answer "contradicted".
+            If the statement is unrelated to the context, please answer "unverified".
+            Do not add any additional words or context to the answer.
+            <statement>{statement}</statement>
+            <context>{context_list}</context>
+            """
+        if self.cascade:
+            verified = self.cascade.verdict(self.session, statement, context_list, verify_prompt)
+        else:
+            verified = cortex.complete(self.session, self.profile.model, verify_prompt).strip()
+
+        # Return the context in the format expected by display_statements
+        formatted_context = []
+        for ctx in context_list:
+            if isinstance(ctx, dict):
+                # If it's already a dictionary, use it as is
+                formatted_context.append(ctx)
+            else:
+                # If it's a Row or other object, convert to dictionary
+                formatted_context.append({
+                    'relative_path': ctx.relative_path if hasattr(ctx, 'relative_path') else str(ctx),
+                    'chunk': ctx.chunk if hasattr(ctx, 'chunk') else str(ctx)
+                })
+
+        return {
+            'result': verified,
+            'context': formatted_context
+        }
+
+    def score_chunks(self, on_progress=None, on_error=None) -> dict:
+        """Verify the statements of every chunk and store a score per chunk.
+
+        on_progress(idx, total) is called before each chunk and on_error(idx, error) when a chunk
+        fails; the failed chunk is skipped. Returns the verdict counts.
+        """
+        # First, ensure the score column exists
+        self.session.sql(f"ALTER TABLE {UNVERIFIED_DOCS_CHUNKS} ADD COLUMN IF NOT EXISTS score FLOAT").collect()
+
+        # for each row in the unverified chunk table:
+        get_statements_sql = f"SELECT * FROM {UNVERIFIED_DOCS_CHUNKS} WHERE {self.own_rows()}"
+        statements = self.session.sql(get_statements_sql).collect()
+        total_statements = len(statements)
+
+        for idx, statement in enumerate(statements):
+            try:
+                if on_progress:
+                    on_progress(idx, total_statements)
+
+                # Handle both string and None cases
+                statements_str = statement["STATEMENTS"] if "STATEMENTS" in statement.asDict() else None
+                if not statements_str:
+                    continue
+
+                # Clean up the statements string
+                statements_str = statements_str.strip()
+                if statements_str.startswith('```json'):
+                    statements_str = statements_str[7:]
+                if statements_str.endswith('```'):
+                    statements_str = statements_str[:-3]
+                statements_str = statements_str.strip()
+
+                statements_list = json.loads(statements_str)
+                if not isinstance(statements_list, list):
+                    continue
+
+                verifications = []
+
+                for st in statements_list:
+                    if not isinstance(st, str):
+                        continue
+                    verification = self.verify_statement(st)
+                    self.results.add(idx + 1, st, verification['result'], verification['context'])
+                    verifications.append(verification['result'])
+                    if verification['result'].lower() == "verified":
+                        self.counts["verified"] += 1
+                    elif verification['result'].lower() == "contradicted":
+                        self.counts["contradicted"] += 1
+                    else:
+                        self.counts["unverified"] += 1
+
+                if verifications:
+                    score = sum([1 if v.lower() == "verified" else 0 for v in verifications]) / len(verifications)
+                    update_score_sql = (f"UPDATE {UNVERIFIED_DOCS_CHUNKS} "
+                                    f"SET score = {score} "
+                                    f"WHERE id = {statement['ID']}")
+                    self.session.sql(update_score_sql).collect()
+
+            except Exception as e:
+                print(f"Detailed error for chunk {idx + 1}: {str(e)}")  # Terminal logging
+                if on_error:
+                    on_error(idx, e)
+                continue
+
+        if on_progress:
+            on_progress(total_statements, total_statements)
+        return self.counts
+
+    def decide(self) -> dict:
+        """Accept the document only if every chunk scores at least the profile's threshold."""
+        num_verified = self.session.sql(f"SELECT COUNT(*) FROM {UNVERIFIED_DOCS_CHUNKS} "
+                                        f"WHERE {self.own_rows()} "
+                                        f"AND score >= {self.profile.acceptance_threshold}").collect()[0]["COUNT(*)"]
+        overall_chunk_length = self.session.sql(f"SELECT COUNT(*) FROM {UNVERIFIED_DOCS_CHUNKS} "
+                                                f"WHERE {self.own_rows()}").collect()[0]["COUNT(*)"]
+        return {
+            "accepted": num_verified == overall_chunk_length,
+            "percentage": (num_verified / overall_chunk_length) * 100 if overall_chunk_length > 0 else 0,
+            "stats": f"{num_verified} out of {overall_chunk_length} chunks verified",
+        }
+
+    def promote(self, parts: list):
+        """Add an accepted document to the verified corpus and its claims to the claim index."""
+        # The parts are already staged, and carry their locally extracted text
+        copy_parts_between_stages(self.session, parts, UNVERIFIED_DOCUMENT_STAGE, VERIFIED_DOCUMENT_STAGE)
+        if not refresh_stage(self.session, VERIFIED_DOCUMENT_STAGE):
+            raise Exception("Error: Unable to refresh verified stage after copy")
+        # Only chunk the accepted file - the rest of the verified stage is already in the table
+        relative_paths = [part["relative_path"] for part in parts]
+        parts_into_table(self.session, VERIFIED_DOCUMENT_STAGE, VERIFIED_DOCS_CHUNKS, parts, self.profile)
+        # Searchable right away, until the search service picks the chunks up
+        self.watermark = OVERLAY.add(self.session, relative_paths)
+        # The statements extracted during verification are still in the unverified table
+        index_extracted_statements(self.session, relative_paths)
+        return self.watermark
+
+    def discard(self, parts: list):
+        """Remove the document's chunks and staged parts, and nothing else, from the unverified workspace."""
+        self.session.sql(f"DELETE FROM {UNVERIFIED_DOCS_CHUNKS} WHERE {self.own_rows()}").collect()
+        for part in parts:
+            # Staged part names only contain [A-Za-z0-9_.-], see chunk_and_upload_file
+            self.session.sql(f"REMOVE @{UNVERIFIED_DOCUMENT_STAGE}/{part['relative_path']}").collect()
+
+    def run(self, file, promote: bool = True) -> dict:
+        """Verify a document end to end and return the decision."""
+        parts = self.upload(file)
+        try:
+            self.chunk(parts)
+            self.create_statements()
+            self.score_chunks()
+            decision = self.decide()
+            if decision["accepted"] and promote:
+                self.promote(parts)
+        finally:
+            self.discard(parts)
+        return decision
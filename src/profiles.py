@@ -0,0 +1,61 @@
+import itertools
+import os
+from dataclasses import dataclass, replace
+
+
+@dataclass(frozen=True)
+class PipelineProfile:
+    """Every tunable setting of the ingestion and verification pipeline.
+
+    Bump `version` whenever the settings of a named profile change, so sweep results and
+    logs can be tied back to the exact settings that produced them.
+    """
+    name: str
+    version: int
+    chunk_size: int = 1024  # characters per chunk in text_chunker
+    chunk_overlap: int = 124  # characters shared by consecutive chunks
+    num_chunks: int = 3  # chunks retrieved as context for every question or statement
+    split_pages: int = 200  # pages per split file uploaded to a stage
+    acceptance_threshold: float = 0.9  # minimum chunk score for a chunk to count as verified
+    model: str = "mistral-large2"  # COMPLETE model for rephrasing, claim extraction and verdicts
+    # Model cascade: a small model answers first and only uncertain answers go to `model`
+    cascade: bool = False
+    small_model: str = "mistral-7b"
+    escalation_confidence: float = 0.8  # first-pass verdicts below this confidence escalate
+    escalate_rejections: bool = True  # re-check every non-"verified" verdict, since it rejects the document
+
+    @property
+    def label(self) -> str:
+        return f"{self.name}@v{self.version}"
+
+
+PROFILES = {profile.name: profile for profile in [
+    PipelineProfile("default", 1),
+    PipelineProfile("fast", 1, chunk_size=2048, chunk_overlap=200, num_chunks=2),
+    PipelineProfile("thorough", 1, chunk_size=512, chunk_overlap=64, num_chunks=5),
+    PipelineProfile("cascade", 1, cascade=True),
+]}
+
+
+def get_profile(name: str = None) -> PipelineProfile:
+    """Look up a profile by name, defaulting to the TRUTH_GUARD_PROFILE environment variable."""
+    name = name or os.getenv("TRUTH_GUARD_PROFILE", "default")
+    if name not in PROFILES:
+        raise ValueError(f"Unknown pipeline profile '{name}'. Available: {', '.join(PROFILES)}")
+    return PROFILES[name]
+
+
+def expand_grid(base: PipelineProfile, grid: dict) -> list:
+    """Derive one profile per combination of the grid values, e.g. {"num_chunks": [3, 5]}."""
+    if not grid:
+        return [base]
+    keys = sorted(grid)
+    profiles = []
+    for values in itertools.product(*(grid[key] for key in keys)):
+        overrides = dict(zip(keys, values))
+        name = f"{base.name}[{','.join(f'{key}={value}' for key, value in overrides.items())}]"
+        profiles.append(replace(base, name=name, **overrides))
+    return profiles
+
+
+ACTIVE_PROFILE = get_profile()
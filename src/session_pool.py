@@ -0,0 +1,189 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from src.metrics import increment, record_timing, set_gauge
+
+
+class SessionPoolTimeout(Exception):
+    """Raised when no session could be checked out in time."""
+
+
+class _PooledSession:
+    def __init__(self, session):
+        self.session = session
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.broken = False
+
+
+class SessionPool:
+    """A bounded pool of Snowpark sessions shared by all Streamlit users.
+
+    Every checkout names a workload (e.g. "chat", "verification", "ingestion"). Each workload
+    has its own concurrency limit, so a burst of long verifications can never take every
+    session away from chat.
+    """
+
+    def __init__(self, session_factory, max_size: int, workload_limits: dict,
+                 health_check_interval: float = 300, max_age: float = 3 * 60 * 60,
+                 checkout_timeout: float = 60):
+        self.session_factory = session_factory
+        self.max_size = max_size
+        self.workload_limits = workload_limits
+        self.health_check_interval = health_check_interval
+        self.max_age = max_age
+        self.checkout_timeout = checkout_timeout
+        self._idle = []
+        self._size = 0
+        self._in_use = {}
+        self._cond = threading.Condition()
+        self._workload_slots = {
+            workload: threading.BoundedSemaphore(limit) for workload, limit in workload_limits.items()
+        }
+
+    @contextmanager
+    def session(self, workload: str = None, timeout: float = None):
+        """Check out a session for the duration of the block and return it to the pool afterwards."""
+        pooled = self.checkout(workload, timeout)
+        try:
+            yield pooled.session
+        except Exception:
+            pooled.broken = self._is_closed(pooled.session)
+            raise
+        finally:
+            self.checkin(pooled, workload)
+
+    def checkout(self, workload: str = None, timeout: float = None) -> _PooledSession:
+        """Take a healthy session out of the pool, creating one if the pool is not full yet."""
+        timeout = self.checkout_timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+
+        slot = self._workload_slots.get(workload)
+        if slot is not None and not slot.acquire(timeout=timeout):
+            increment(f"pool.timeouts.{workload}")
+            raise SessionPoolTimeout(f"No {workload} session available after {timeout}s")
+
+        try:
+            pooled = self._take(deadline)
+        except Exception:
+            if slot is not None:
+                slot.release()
+            increment(f"pool.timeouts.{workload}")
+            raise
+
+        record_timing(f"pool.wait.{workload}", time.monotonic() - start)
+        with self._cond:
+            self._in_use[workload] = self._in_use.get(workload, 0) + 1
+            self._publish_gauges()
+        return pooled
+
+    def checkin(self, pooled: _PooledSession, workload: str = None):
+        """Return a session to the pool, discarding it if it is broken."""
+        pooled.last_used = time.monotonic()
+        with self._cond:
+            self._in_use[workload] -= 1
+            if pooled.broken or self._is_closed(pooled.session):
+                print("Discarding broken Snowflake session")
+                self._discard(pooled)
+            else:
+                self._idle.append(pooled)
+            self._publish_gauges()
+            self._cond.notify()
+        slot = self._workload_slots.get(workload)
+        if slot is not None:
+            slot.release()
+
+    def stats(self) -> dict:
+        """Current pool occupancy, per workload."""
+        with self._cond:
+            in_use = sum(self._in_use.values())
+            return {
+                "size": self._size,
+                "max_size": self.max_size,
+                "in_use": in_use,
+                "idle": len(self._idle),
+                "utilisation": in_use / self.max_size,
+                "in_use_by_workload": dict(self._in_use),
+            }
+
+    def close(self):
+        """Close every idle session. Sessions that are checked out are closed on checkin."""
+        with self._cond:
+            for pooled in self._idle:
+                self._discard(pooled)
+            self._idle = []
+            self._publish_gauges()
+
+    def _take(self, deadline: float) -> _PooledSession:
+        while True:
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise SessionPoolTimeout(f"Session pool exhausted ({self.max_size} sessions in use)")
+                    self._cond.wait(remaining)
+                if self._idle:
+                    pooled = self._idle.pop()
+                else:
+                    # Reserve the slot before connecting so concurrent checkouts don't overshoot
+                    self._size += 1
+                    pooled = None
+
+            if pooled is None:
+                return self._connect()
+            if self._is_healthy(pooled):
+                return pooled
+            with self._cond:
+                self._discard(pooled)
+            print("Reconnecting expired Snowflake session")
+            increment("pool.reconnects")
+
+    def _connect(self) -> _PooledSession:
+        try:
+            pooled = _PooledSession(self.session_factory())
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        increment("pool.sessions_created")
+        return pooled
+
+    def _is_healthy(self, pooled: _PooledSession) -> bool:
+        now = time.monotonic()
+        if now - pooled.created_at > self.max_age or self._is_closed(pooled.session):
+            return False
+        if now - pooled.last_used < self.health_check_interval:
+            return True
+        try:
+            pooled.session.sql("SELECT 1").collect()
+            return True
+        except Exception as e:
+            print(f"Session health check failed: {str(e)}")
+            return False
+
+    @staticmethod
+    def _is_closed(session) -> bool:
+        try:
+            return session.connection.is_closed()
+        except Exception:
+            return True
+
+    def _discard(self, pooled: _PooledSession):
+        # Caller holds self._cond
+        self._size -= 1
+        try:
+            pooled.session.close()
+        except Exception as e:
+            print(f"Error closing session: {str(e)}")
+
+    def _publish_gauges(self):
+        # Caller holds self._cond
+        in_use = sum(self._in_use.values())
+        set_gauge("pool.size", self._size)
+        set_gauge("pool.in_use", in_use)
+        set_gauge("pool.utilisation", in_use / self.max_size)
+        for workload, count in self._in_use.items():
+            set_gauge(f"pool.in_use.{workload}", count)
@@ -0,0 +1,95 @@
+import io
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from src.config import TEXT_LAYER_CONFIG
+from src.metrics import timed_import, timer
+
+WORD_PATTERN = re.compile(r"[^\W\d_]{2,20}")
+
+
+def is_good_text_layer(text: str, min_chars: int = TEXT_LAYER_CONFIG["min_chars"],
+                       min_word_ratio: float = TEXT_LAYER_CONFIG["min_word_ratio"]) -> bool:
+    """Decide whether a page's embedded text is good enough to skip PARSE_DOCUMENT.
+
+    Scanned pages have no or very little text, and broken text layers show up as unmapped
+    glyphs ("(cid:12)", replacement characters) or runs of characters that don't form words.
+    """
+    stripped = (text or "").strip()
+    if len(stripped) < min_chars:
+        return False
+    if "(cid:" in stripped or "�" in stripped:
+        return False
+    tokens = stripped.split()
+    words = [token for token in tokens if WORD_PATTERN.search(token)]
+    return len(words) / len(tokens) >= min_word_ratio
+
+
+def _extract_page_range(source, start: int, end: int) -> list:
+    reader = timed_import("PyPDF2").PdfReader(io.BytesIO(source) if isinstance(source, bytes) else source)
+    texts = []
+    for page_idx in range(start, end):
+        try:
+            texts.append(reader.pages[page_idx].extract_text() or "")
+        except Exception as e:
+            print(f"Error extracting text of page {page_idx}: {str(e)}")
+            texts.append("")
+    return texts
+
+
+def extract_page_texts(source, num_pages: int, max_workers: int = TEXT_LAYER_CONFIG["max_workers"]) -> list:
+    """Extract the text layer of every page, splitting the pages across worker processes.
+
+    source is a file path or an in-memory PDF (a BytesIO, like a Streamlit UploadedFile).
+    Returns one string per page.
+    """
+    with timer("ingestion.text_layer_extraction"):
+        workers = min(max_workers, num_pages // TEXT_LAYER_CONFIG["min_pages_per_worker"])
+        if not isinstance(source, str):
+            # Every worker receives its own copy of an in-memory document
+            workers = min(workers, TEXT_LAYER_CONFIG["max_worker_bytes"] // max(source.getbuffer().nbytes, 1))
+        if workers <= 1:
+            # In this process the document is read in place, without a copy
+            return _extract_page_range(source, 0, num_pages)
+        if not isinstance(source, str):
+            source = source.getvalue()
+        step = -(-num_pages // workers)
+        ranges = [(start, min(start + step, num_pages)) for start in range(0, num_pages, step)]
+        # Forking the threaded Streamlit server could copy a held lock into the workers
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = [executor.submit(_extract_page_range, source, start, end) for start, end in ranges]
+            return [text for future in futures for text in future.result()]
+
+
+def split_by_quality(page_texts: list, start: int, end: int,
+                     min_run_pages: int = TEXT_LAYER_CONFIG["min_run_pages"],
+                     max_bad_ratio: float = TEXT_LAYER_CONFIG["max_bad_ratio"]) -> list:
+    """Split pages [start, end) into runs of pages with and without a good text layer.
+
+    Returns (run_start, run_end, text) tuples where text is the run's extracted text, or None
+    when its pages must go through PARSE_DOCUMENT. Every run is a separate upload and job, so
+    good runs shorter than min_run_pages are parsed along with their neighbours, and a window
+    that is mostly bad is parsed as a whole.
+    """
+    if page_texts is None:
+        return [(start, end, None)]
+    good_pages = [is_good_text_layer(page_texts[page_idx]) for page_idx in range(start, end)]
+    if good_pages.count(False) > max_bad_ratio * len(good_pages):
+        return [(start, end, None)]
+
+    runs = []
+    for page_idx, good in zip(range(start, end), good_pages):
+        if runs and runs[-1][2] == good:
+            runs[-1][1] = page_idx + 1
+        else:
+            runs.append([page_idx, page_idx + 1, good])
+    merged = []
+    for run_start, run_end, good in runs:
+        good = good and (run_end - run_start >= min_run_pages or len(runs) == 1)
+        if merged and merged[-1][2] == good:
+            merged[-1][1] = run_end
+        else:
+            merged.append([run_start, run_end, good])
+    return [(run_start, run_end, "\n\n".join(page_texts[run_start:run_end]) if good else None)
+            for run_start, run_end, good in merged]
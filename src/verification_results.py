@@ -0,0 +1,50 @@
+STATUSES = ["verified", "contradicted", "unverified"]
+
+
+class VerificationResults:
+    """Compact store of the verification results of one document.
+
+    The same corpus chunks come back as context for many statements, so every context chunk is
+    interned once in `contexts` and statements only keep their IDs.
+    """
+
+    def __init__(self):
+        self.contexts = []
+        self._context_ids = {}
+        # (chunk_num, statement, status, raw result, context IDs), in document order
+        self.statements = []
+
+    def add(self, chunk_num: int, statement: str, result: str, context: list):
+        """Record the verdict for one statement along with its supporting context."""
+        context_ids = tuple(self._intern(ctx) for ctx in context)
+        status = result.lower()
+        if status not in STATUSES:
+            status = "unverified"
+        self.statements.append((chunk_num, statement, status, result, context_ids))
+
+    def context(self, context_id: int) -> dict:
+        return self.contexts[context_id]
+
+    def counts(self) -> dict:
+        counts = {status: 0 for status in STATUSES}
+        for _, _, status, _, _ in self.statements:
+            counts[status] += 1
+        return counts
+
+    def filter(self, status: str = None, text: str = None) -> list:
+        """Return the statements matching the given status and containing the given text."""
+        text = text.lower() if text else None
+        return [
+            stmt for stmt in self.statements
+            if (status is None or stmt[2] == status) and (text is None or text in stmt[1].lower())
+        ]
+
+    def __len__(self):
+        return len(self.statements)
+
+    def _intern(self, ctx: dict) -> int:
+        key = (ctx['relative_path'], ctx['chunk'])
+        if key not in self._context_ids:
+            self._context_ids[key] = len(self.contexts)
+            self.contexts.append({'relative_path': ctx['relative_path'], 'chunk': ctx['chunk']})
+        return self._context_ids[key]
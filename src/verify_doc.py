@@ -1,170 +1,42 @@
-import json
-import os
-import pandas as pd
-
-from initial_file_ingestion import upload_file_to_stage, write_file_to_stage, chunks_into_table, refresh_stage
-from src.chat import NUM_CHUNKS, COLUMNS
 from src.database import *
+from src.metrics import timed_import
+from src.pipeline import VerificationPipeline
+from src.profiles import ACTIVE_PROFILE
+from src.session_pool import SessionPoolTimeout
+from src.verification_results import VerificationResults
+
+# Verifications are limited per process, so don't keep a second user waiting on a long run
+VERIFICATION_CHECKOUT_TIMEOUT = 10
 
 
 class VerifyDoc:
-    def __init__(self, streamlit, session, css):
+    def __init__(self, streamlit, session_pool, profile=ACTIVE_PROFILE):
         self.st = streamlit
-        self.session = session
-        self.css = css
-        os.makedirs("tmp/split_files", exist_ok=True)
-
-    def create_statements(self):
-        create_statements_sql = ("CREATE OR REPLACE TEMPORARY TABLE chunks_statements AS "
-                                 "WITH unique_statement AS "
-                                 f"(SELECT DISTINCT id, relative_path, chunk FROM {UNVERIFIED_DOCS_CHUNKS}), "
-                                 "chunks_statements AS (SELECT id, relative_path, "
-                                 "TRIM(snowflake.cortex.COMPLETE ('mistral-large2', "
-                                 "'Return a json formatted list of statements documented in the text. "
-                                 "Return only the list with no additional information."
-                                 " <text>' || chunk || '</text>'), "
-                                 "'\n') AS statements "
-                                 "FROM unique_statement) "
-                                 "SELECT * FROM chunks_statements;"
-                                 )
-        print(create_statements_sql)
-        self.session.sql(create_statements_sql).collect()
-        update_table_sql = (f"update {UNVERIFIED_DOCS_CHUNKS}  "
-                            f"SET statements = chunks_statements.statements "
-                            f"from chunks_statements "
-                            f"where  {UNVERIFIED_DOCS_CHUNKS}.id = chunks_statements.id;")
-        print(update_table_sql)
-        self.session.sql(update_table_sql).collect()
-
-    def verify_statement(self, statement):
-        print(f"Finding context for statement: {statement}")
-        search_results = self.css.search(statement, COLUMNS, limit=NUM_CHUNKS)
-        print(f"Context for statement: {search_results}")
-        
-        # Extract the results from the search_results
-        if hasattr(search_results, 'results'):
-            context_list = search_results.results
-        else:
-            # If search_results is already a list
-            context_list = search_results
-        
-        verify_prompt = f"""
-            You are an expert chat assistance that verifies statements using the CONTEXT provided.
-            If the statement is supported by the context, please answer "verified". If the statement is contradicted by the context, please answer "contradicted".
-            If the statement is unrelated to the context, please answer "unverified".
-            Do not add any additional words or context to the answer.
-            <statement>{statement}</statement>
-            <context>{context_list}</context>
-            """
-        cmd = "select snowflake.cortex.complete(?, ?) as response"
-        df_response = self.session.sql(cmd, params=['mistral-large2', verify_prompt]).collect()
-        verified = df_response[0].RESPONSE.strip()
-        
-        # Return the context in the format expected by display_statements
-        formatted_context = []
-        for ctx in context_list:
-            if isinstance(ctx, dict):
-                # If it's already a dictionary, use it as is
-                formatted_context.append(ctx)
-            else:
-                # If it's a Row or other object, convert to dictionary
-                formatted_context.append({
-                    'relative_path': ctx.relative_path if hasattr(ctx, 'relative_path') else str(ctx),
-                    'chunk': ctx.chunk if hasattr(ctx, 'chunk') else str(ctx)
-                })
-        
-        return {
-            'result': verified,
-            'context': formatted_context
-        }
+        self.session_pool = session_pool
+        self.profile = profile
+        # only bound while a verification holds a pooled session
+        self.pipeline = None
 
     def create_chunk_score(self):
-        # First, ensure the score column exists
         try:
-            self.session.sql(f"ALTER TABLE {UNVERIFIED_DOCS_CHUNKS} ADD COLUMN IF NOT EXISTS score FLOAT").collect()
-            
-            # for each row in the unverified chunk table:
-            get_statements_sql = f"SELECT * FROM {UNVERIFIED_DOCS_CHUNKS}"
-            statements = self.session.sql(get_statements_sql).collect()
-            total_statements = len(statements)
-            
             progress_bar = self.st.progress(0, "Verifying statements")
             status_text = self.st.empty()
             results_area = self.st.container()
-            
-            # Store verification results
-            if 'verification_results' not in self.st.session_state:
-                self.st.session_state.verification_results = []
-            
-            total_verifications = 0
-            total_verified = 0
-            contradicted = 0
-            unverified = 0
-            
-            for idx, statement in enumerate(statements):
-                try:
-                    status_text.write(f"Processing chunk {idx + 1} of {total_statements}")
-                    
-                    # Handle both string and None cases
-                    statements_str = statement["STATEMENTS"] if "STATEMENTS" in statement.asDict() else None
-                    if not statements_str:
-                        continue
-                    
-                    # Clean up the statements string
-                    statements_str = statements_str.strip()
-                    if statements_str.startswith('```json'):
-                        statements_str = statements_str[7:]
-                    if statements_str.endswith('```'):
-                        statements_str = statements_str[:-3]
-                    statements_str = statements_str.strip()
-                        
-                    statements_list = json.loads(statements_str)
-                    if not isinstance(statements_list, list):
-                        continue
-                        
-                    verifications = []
-                    verification_text = []
-                    
-                    for st in statements_list:
-                        if not isinstance(st, str):
-                            continue
-                        verification = self.verify_statement(st)
-                        verification_text.append({
-                            "statement": st,
-                            "result": verification['result'],
-                            "context": verification['context']
-                        })
-                        verifications.append(verification['result'])
-                        total_verifications += 1
-                        if verification['result'].lower() == "verified":
-                            total_verified += 1
-                        elif verification['result'].lower() == "contradicted":
-                            contradicted += 1
-                        else:
-                            unverified += 1
-                    
-                    # Store results for this chunk
-                    if verification_text:
-                        self.st.session_state.verification_results.append({
-                            "chunk_num": idx + 1,
-                            "verifications": verification_text
-                        })
-                    
-                    if verifications:
-                        score = sum([1 if v.lower() == "verified" else 0 for v in verifications]) / len(verifications)
-                        update_score_sql = (f"UPDATE {UNVERIFIED_DOCS_CHUNKS} "
-                                        f"SET score = {score} "
-                                        f"WHERE id = {statement['ID']}")
-                        self.session.sql(update_score_sql).collect()
-                        
-                    # Update progress
-                    progress_bar.progress((idx + 1) / total_statements, 
-                                       f"Processed {idx + 1} of {total_statements} chunks")
-                        
-                except Exception as e:
-                    self.st.warning(f"Error processing chunk {idx + 1}: {str(e)}")
-                    print(f"Detailed error for chunk {idx + 1}: {str(e)}")  # Terminal logging
-                    continue
+
+            def on_progress(idx, total):
+                if idx < total:
+                    status_text.write(f"Processing chunk {idx + 1} of {total}")
+                if idx > 0:
+                    progress_bar.progress(idx / total, f"Processed {idx} of {total} chunks")
+
+            def on_error(idx, e):
+                self.st.warning(f"Error processing chunk {idx + 1}: {str(e)}")
+
+            counts = self.pipeline.score_chunks(on_progress, on_error)
+            total_verified = counts["verified"]
+            contradicted = counts["contradicted"]
+            unverified = counts["unverified"]
+            total_verifications = total_verified + contradicted + unverified
             
             # Show final analysis results
             status_text.empty()
@@ -195,12 +67,16 @@ class VerifyDoc:
                     
                     # Show results table
                     self.st.subheader("Verification Details")
+                    pd = timed_import("pandas")
                     results_df = pd.DataFrame([
                         {"Result Type": "Verified", "Count": total_verified},
                         {"Result Type": "Contradicted", "Count": contradicted},
                         {"Result Type": "Unverified", "Count": unverified}
                     ])
                     self.st.bar_chart(results_df.set_index("Result Type"))
+
+                    self.show_fast_path_report()
+                    self.show_cascade_report()
             
             return True
             
@@ -210,91 +86,105 @@ class VerifyDoc:
             print(f"Detailed error: {error_msg}")  # Terminal logging
             return False
 
+    def show_fast_path_report(self):
+        """Report how many statements the claim index answered and the time that saved"""
+        stats = self.pipeline.fast_path_stats
+        total = stats["hits"] + stats["misses"]
+        if total == 0:
+            return
+        # Hits would have cost an average LLM verification; every lookup is overhead
+        avg_llm_time = stats["llm_time"] / stats["misses"] if stats["misses"] else 0
+        saved = stats["hits"] * avg_llm_time - stats["lookup_time"]
+        print(f"Claim index fast path: {stats['hits']}/{total} statements, ~{saved:.1f}s saved")
+        col1, col2 = self.st.columns(2)
+        with col1:
+            self.st.metric("Answered from Claim Index", f"{stats['hits'] / total * 100:.1f}%",
+                           f"{stats['hits']} of {total} statements")
+        with col2:
+            self.st.metric("Estimated Time Saved", f"{saved:.1f}s")
+
+    def show_cascade_report(self):
+        """Report how often the small model had to escalate and what the cascade saved"""
+        if not self.pipeline.cascade:
+            return
+        report = self.pipeline.cascade.report()
+        if not report:
+            return
+        print(f"Model cascade: {report}")
+        col1, col2, col3 = self.st.columns(3)
+        with col1:
+            self.st.metric("Escalated to Large Model", f"{report['escalation_rate'] * 100:.1f}%",
+                           f"{report['decisions']} verdicts, {report['extraction_escalations']} extractions escalated")
+        with col2:
+            self.st.metric("Estimated Latency Saved", f"{report['latency_saved']:.1f}s")
+        with col3:
+            self.st.metric("Estimated Credits Saved", f"{report['credits_saved']:.4f}")
+
     def display_verification_results(self):
-        """Display the stored verification results"""
-        if 'verification_results' in self.st.session_state and self.st.session_state.verification_results:
-            # Display final status if available
-            if 'verification_status' in self.st.session_state:
-                if self.st.session_state.verification_status == "accepted":
-                    self.st.success("## Document accepted and added to verified corpus 🎉")
-                else:
-                    self.st.error("## Document rejected 😔")
-                    self.st.write("The document contains unverified or contradicted statements.")
-            
-            # Display final score if available
-            if 'final_score' in self.st.session_state:
-                self.st.metric(
-                    "Verification Score", 
-                    f"{self.st.session_state.final_score['percentage']:.1f}%", 
-                    self.st.session_state.final_score['stats']
-                )
-            
-            # Display detailed results
-            self.st.subheader("Detailed Verification Results")
-            
-            # Create tabs for different verification statuses
-            verified_statements = []
-            contradicted_statements = []
-            unverified_statements = []
-            
-            # Collect statements by verification status
-            for chunk_result in self.st.session_state.verification_results:
-                for v in chunk_result['verifications']:
-                    result = v['result'].lower()
-                    statement_info = {
-                        'chunk': chunk_result['chunk_num'],
-                        'statement': v['statement'],
-                        'context': v['context']
-                    }
-                    if result == 'verified':
-                        verified_statements.append(statement_info)
-                    elif result == 'contradicted':
-                        contradicted_statements.append(statement_info)
+        """Display the stored verification results, one filtered page at a time"""
+        # The view is rendered into an st.empty() slot, which only keeps a single element
+        with self.st.container():
+            if 'verification_results' in self.st.session_state and self.st.session_state.verification_results:
+                results = self.st.session_state.verification_results
+
+                # Display final status if available
+                if 'verification_status' in self.st.session_state:
+                    if self.st.session_state.verification_status == "accepted":
+                        self.st.success("## Document accepted and added to verified corpus 🎉")
                     else:
-                        unverified_statements.append(statement_info)
+                        self.st.error("## Document rejected 😔")
+                        self.st.write("The document contains unverified or contradicted statements.")
             
-            # Create tabs
-            tab1, tab2, tab3 = self.st.tabs(["✅ Verified", "❌ Contradicted", "❓ Unverified"])
+                # Display final score if available
+                if 'final_score' in self.st.session_state:
+                    self.st.metric(
+                        "Verification Score", 
+                        f"{self.st.session_state.final_score['percentage']:.1f}%", 
+                        self.st.session_state.final_score['stats']
+                    )
             
-            def display_statements(statements, status):
-                if statements:
-                    for stmt in statements:
-                        self.st.markdown(f"### {stmt['statement']}")
-                        self.st.markdown(f"**From Chunk {stmt['chunk']}**")
-                        self.st.markdown("**Supporting Context:**")
-                        for idx, context in enumerate(stmt['context'], 1):
-                            self.st.markdown(f"""
-                            ---
-                            **Source {idx}**: {context['relative_path']}
-                            ```
-                            {context['chunk']}
-                            ```
-                            """)
-                        self.st.divider()
-                else:
-                    self.st.info(f"No {status} statements found.")
-            
-            # Verified statements tab
-            with tab1:
-                display_statements(verified_statements, "verified")
-            
-            # Contradicted statements tab
-            with tab2:
-                display_statements(contradicted_statements, "contradicted")
-            
-            # Unverified statements tab
-            with tab3:
-                display_statements(unverified_statements, "unverified")
-            
-            # Show all statements in chronological order
-            with self.st.expander("View All Statements in Order"):
-                for chunk_result in self.st.session_state.verification_results:
-                    self.st.markdown(f"### Chunk {chunk_result['chunk_num']}")
-                    for v in chunk_result['verifications']:
-                        status_emoji = "✅" if v['result'].lower() == 'verified' else "❌" if v['result'].lower() == 'contradicted' else "❓"
-                        self.st.markdown(f"{status_emoji} **{v['result']}**: {v['statement']}")
+                # Display detailed results
+                self.st.subheader("Detailed Verification Results")
+
+                counts = results.counts()
+                filter_options = {
+                    f"All ({len(results)})": None,
+                    f"✅ Verified ({counts['verified']})": "verified",
+                    f"❌ Contradicted ({counts['contradicted']})": "contradicted",
+                    f"❓ Unverified ({counts['unverified']})": "unverified",
+                }
+                col1, col2, col3 = self.st.columns([3, 2, 1])
+                with col1:
+                    selected = self.st.radio("Show:", list(filter_options), horizontal=True, key="results_filter")
+                with col2:
+                    search_text = self.st.text_input("Search statements", placeholder="Filter by text",
+                                                    key="results_search")
+                with col3:
+                    page_size = self.st.selectbox("Per page", [10, 25, 50], index=0, key="results_page_size")
+
+                statements = results.filter(filter_options[selected], search_text)
+                if not statements:
+                    self.st.info("No matching statements found.")
+                    return
+
+                num_pages = (len(statements) - 1) // page_size + 1
+                col1, col2 = self.st.columns([1, 3])
+                with col1:
+                    page = self.st.number_input("Page", min_value=1, max_value=num_pages, value=1, step=1,
+                                                key="results_page")
+                with col2:
+                    show_context = self.st.toggle("Show supporting context", value=False, key="results_show_context")
+                self.st.caption(f"Showing {len(statements)} statements, page {page} of {num_pages}")
+
+                # Only the visible page is rendered
+                for chunk_num, statement, status, result, context_ids in statements[(page - 1) * page_size:page * page_size]:
+                    status_emoji = "✅" if status == 'verified' else "❌" if status == 'contradicted' else "❓"
+                    self.st.markdown(f"{status_emoji} **{result}**: {statement}")
+                    self.st.caption(f"From Chunk {chunk_num}")
+                    if show_context:
                         self.st.markdown("**Supporting Context:**")
-                        for idx, context in enumerate(v['context'], 1):
+                        for idx, context_id in enumerate(context_ids, 1):
+                            context = results.context(context_id)
                             self.st.markdown(f"""
                             ---
                             **Source {idx}**: {context['relative_path']}
@@ -302,35 +192,40 @@ class VerifyDoc:
                             {context['chunk']}
                             ```
                             """)
-                        self.st.divider()
-                    self.st.markdown("---")
+                    self.st.divider()
 
     def verify_document(self, uploaded_file):
-        results_placeholder = self.st.empty()
-        
+        try:
+            # The whole run stays on one session - chunks_statements is a temporary table
+            with self.session_pool.session("verification", timeout=VERIFICATION_CHECKOUT_TIMEOUT) as session:
+                if 'verification_results' not in self.st.session_state:
+                    self.st.session_state.verification_results = VerificationResults()
+                self.pipeline = VerificationPipeline(session, get_css(session), self.profile,
+                                                     self.st.session_state.verification_results)
+                self._verify_document(uploaded_file)
+        except SessionPoolTimeout:
+            self.st.warning("Another document is being verified right now. Please try again in a few minutes.")
+        except Exception as e:
+            self.st.error(str(e))
+            print(f"Detailed error: {str(e)}")  # Terminal logging
+        finally:
+            # Also when scoring stopped early or no session was free, so the page stays usable
+            self.st.session_state.processing = False
+            self.pipeline = None
+
+    def _verify_document(self, uploaded_file):
         with self.st.status("Processing document...") as status:
             # 1. upload to unverified stage
             status.update(label="Uploading document...")
-            uploaded_files = upload_file_to_stage(self.session, uploaded_file, UNVERIFIED_DOCUMENT_STAGE)
-            if not uploaded_files or len(uploaded_files) == 0:
-                self.st.error("Error: Unable to upload the document")
-                return
-                
-            # Refresh stage after upload
-            status.update(label="Preparing document for analysis...")
-            if not refresh_stage(self.session, UNVERIFIED_DOCUMENT_STAGE):
-                self.st.error("Error: Unable to refresh stage after upload")
-                return
+            parts = self.pipeline.upload(uploaded_file)
                 
             # 2. chunk the document
             status.update(label="Breaking document into analyzable chunks...")
-            if not chunks_into_table(self.session, UNVERIFIED_DOCUMENT_STAGE, UNVERIFIED_DOCS_CHUNKS):
-                self.st.error("Error: Unable to chunk the document")
-                return
+            self.pipeline.chunk(parts)
                 
             # 3. create statements
             status.update(label="Extracting statements from chunks...")
-            self.create_statements()
+            self.pipeline.create_statements()
             
             # 4. verify statements
             status.update(label="Verifying statements against trusted corpus...")
@@ -339,50 +234,34 @@ class VerifyDoc:
                 
             # 5. make decision
             status.update(label="Making final verification decision...")
-            num_verified = self.session.sql(f"SELECT COUNT(*) FROM {UNVERIFIED_DOCS_CHUNKS} WHERE score >= 0.9").collect()[0]["COUNT(*)"]
-            overall_chunk_length = self.session.sql(f"SELECT COUNT(*) FROM {UNVERIFIED_DOCS_CHUNKS}").collect()[0]["COUNT(*)"]
-            
-            verification_stats = f"{num_verified} out of {overall_chunk_length} chunks verified"
-            verification_percentage = (num_verified / overall_chunk_length) * 100 if overall_chunk_length > 0 else 0
+            decision = self.pipeline.decide()
             
             # Store the final results in session state
             self.st.session_state.final_score = {
-                "percentage": verification_percentage,
-                "stats": verification_stats
+                "percentage": decision["percentage"],
+                "stats": decision["stats"]
             }
             
-            accepted = num_verified == overall_chunk_length
-            if accepted:
+            if decision["accepted"]:
                 status.update(label="Document accepted! Adding to verified corpus...", state="complete")
                 self.st.session_state.verification_status = "accepted"
                 
                 # 6. if accepted, move to verified corpus
-                write_file_to_stage(self.session, uploaded_file, VERIFIED_DOCUMENT_STAGE)
-                if not refresh_stage(self.session, VERIFIED_DOCUMENT_STAGE):
-                    self.st.error("Error: Unable to refresh verified stage after upload")
-                    return
-                chunks_into_table(self.session, VERIFIED_DOCUMENT_STAGE, VERIFIED_DOCS_CHUNKS)
+                self.pipeline.promote(parts)
             else:
                 status.update(label="Document verification complete", state="complete")
                 self.st.session_state.verification_status = "rejected"
                 
             # 7. cleanup database and files
-            self.session.sql(f"DELETE FROM {UNVERIFIED_DOCS_CHUNKS}").collect()
-            self.session.sql(f"REMOVE @{UNVERIFIED_DOCUMENT_STAGE}/{uploaded_file}").collect()
-            self.cleanup(uploaded_file, rerun=False)
-            
-            # Display results immediately
-            with results_placeholder:
-                self.display_verification_results()
+            self.pipeline.discard(parts)
+            self.cleanup(rerun=False)
             
             # Reset processing state
             self.st.session_state.processing = False
 
-    def cleanup(self, uploaded_file, rerun=False):
-        """Cleanup temporary files and optionally reset the UI"""
-        os.remove(uploaded_file)
-        # Clear session state for new upload
-        self.st.session_state.current_file = None
+    def cleanup(self, rerun=False):
+        """Reset the upload state and optionally the UI"""
+        # current_file is kept, so the results survive the reruns of the results view's widgets
         self.st.session_state.processing = False
         if rerun:
             self.st.rerun()
@@ -400,14 +279,9 @@ class VerifyDoc:
         if 'current_file' not in self.st.session_state:
             self.st.session_state.current_file = None
 
-        # Create a placeholder for results
+        # Create a placeholder for results, filled once at the end of the run
         results_area = self.st.empty()
 
-        # Display existing results if available and not processing
-        if not self.st.session_state.processing:
-            with results_area:
-                self.display_verification_results()
-
         uploaded_file = self.st.file_uploader(
             "Upload a PDF to fact-check:",
             type=["pdf"],
@@ -417,14 +291,10 @@ class VerifyDoc:
 
         if uploaded_file:
             self.st.write("Uploaded file:", uploaded_file.name)
-            # save file locally
-            temp_file_path = "tmp/" + uploaded_file.name.replace(" ", "_")
-            
-            # Only write file if it's a new one
-            if uploaded_file.name != self.st.session_state.current_file:
-                with open(temp_file_path, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
-                self.st.session_state.current_file = uploaded_file.name
+
+            # Only reset the results if it's a new upload, not on every rerun
+            if uploaded_file.file_id != self.st.session_state.current_file:
+                self.st.session_state.current_file = uploaded_file.file_id
                 # Clear previous results when new file is uploaded
                 for key in ['verification_results', 'verification_status', 'final_score']:
                     if key in self.st.session_state:
@@ -441,4 +311,10 @@ class VerifyDoc:
                 self.st.session_state.processing = True
                 # Clear previous results before starting new verification
                 results_area.empty()
-                self.verify_document(temp_file_path)
+                # The uploaded bytes are split and streamed to the stage straight from memory
+                self.verify_document(uploaded_file)
+
+        # Display the results, including those of a verification that just finished, once per run
+        if not self.st.session_state.processing:
+            with results_area:
+                self.display_verification_results()
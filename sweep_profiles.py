@@ -0,0 +1,125 @@
+"""Run the verification pipeline over a grid of pipeline profiles on labelled documents.
+
+Example:
+    python3.11 sweep_profiles.py --profiles default fast --grid num_chunks=2,3,5
+
+Nothing is promoted to the verified corpus. Every run only touches its own files and rows in the
+unverified workspace, so the sweep can run next to the live app.
+"""
+import argparse
+import csv
+import os
+import time
+from dataclasses import fields
+
+from src.database import *
+from src.metrics import get_metrics
+from src.pipeline import VerificationPipeline
+from src.profiles import PROFILES, PipelineProfile, expand_grid, get_profile
+
+docs_dir_path = os.path.join(os.path.dirname(__file__), "verify_docs")
+
+
+def parse_grid(grid_args: list) -> dict:
+    """Parse ["num_chunks=2,3", ...] into {"num_chunks": [2, 3]} using the profile field types."""
+    field_types = {field.name: field.type for field in fields(PipelineProfile)}
+    grid = {}
+    for arg in grid_args or []:
+        key, values = arg.split("=", 1)
+        if key not in field_types or key in ("name", "version"):
+            raise ValueError(f"Unknown profile setting '{key}'")
+        if field_types[key] is bool:
+            grid[key] = [value.lower() in ("1", "true", "yes") for value in values.split(",")]
+        else:
+            grid[key] = [field_types[key](value) for value in values.split(",")]
+    return grid
+
+
+def llm_usage() -> tuple:
+    counters = get_metrics()["counters"]
+    return (counters.get("cortex.llm_calls", 0), counters.get("cortex.tokens", 0),
+            counters.get("cascade.first_pass", 0), counters.get("cascade.escalated", 0))
+
+
+def run_profile(session, css, profile: PipelineProfile, labelled_docs: list) -> dict:
+    print(f"Sweeping profile {profile.label}: {profile}")
+    calls_before, tokens_before, first_pass_before, escalated_before = llm_usage()
+    latencies = []
+    correct = 0
+    savings = {"latency_saved_s": 0.0, "credits_saved": 0.0}
+    for file, expected_accept in labelled_docs:
+        start = time.monotonic()
+        pipeline = VerificationPipeline(session, css, profile)
+        try:
+            decision = pipeline.run(file, promote=False)
+            accepted = decision["accepted"]
+        except Exception as e:
+            print(f"Error verifying {file} with {profile.label}: {str(e)}")
+            accepted = None
+        latencies.append(time.monotonic() - start)
+        cascade_report = pipeline.cascade.report() if pipeline.cascade else None
+        if cascade_report:
+            savings["latency_saved_s"] += cascade_report["latency_saved"]
+            savings["credits_saved"] += cascade_report["credits_saved"]
+        correct += accepted == expected_accept
+        print(f"{profile.label} {os.path.basename(file)}: accepted={accepted} expected={expected_accept} "
+              f"in {latencies[-1]:.1f}s")
+    calls_after, tokens_after, first_pass_after, escalated_after = llm_usage()
+    escalated = escalated_after - escalated_before
+    cascade_decisions = escalated + first_pass_after - first_pass_before
+    return {
+        "profile": profile.label,
+        "accuracy": correct / len(labelled_docs),
+        "total_latency_s": sum(latencies),
+        "avg_latency_s": sum(latencies) / len(latencies),
+        "llm_calls": calls_after - calls_before,
+        "tokens": round(tokens_after - tokens_before),
+        "escalation_rate": escalated / cascade_decisions if cascade_decisions else "",
+        "latency_saved_s": savings["latency_saved_s"] if profile.cascade else "",
+        "credits_saved": savings["credits_saved"] if profile.cascade else "",
+    }
+
+
+def print_report(rows: list):
+    columns = ["profile", "accuracy", "total_latency_s", "avg_latency_s", "llm_calls", "tokens", "escalation_rate",
+               "latency_saved_s", "credits_saved"]
+    print(" | ".join(columns))
+    for row in rows:
+        # Credits per run are small, so they get more digits
+        print(" | ".join(f"{row[c]:.{4 if c == 'credits_saved' else 2}f}" if isinstance(row[c], float) else str(row[c])
+                         for c in columns))
+
+    best_accuracy = max(row["accuracy"] for row in rows)
+    fastest = min((row for row in rows if row["accuracy"] == best_accuracy), key=lambda row: row["total_latency_s"])
+    print(f"Fastest profile with the best accuracy ({best_accuracy:.0%}): {fastest['profile']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", nargs="+", default=["default"], choices=list(PROFILES))
+    parser.add_argument("--grid", nargs="*", help="setting=value1,value2 combinations applied to every profile")
+    parser.add_argument("--accept", nargs="*", default=[os.path.join(docs_dir_path, "verify_truth.pdf")],
+                        help="documents that should be accepted")
+    parser.add_argument("--reject", nargs="*", default=[os.path.join(docs_dir_path, "verify_false.pdf")],
+                        help="documents that should be rejected")
+    parser.add_argument("--csv", help="also write the report to this CSV file")
+    args = parser.parse_args()
+
+    grid = parse_grid(args.grid)
+    profiles = [profile for name in args.profiles for profile in expand_grid(get_profile(name), grid)]
+    labelled_docs = [(f, True) for f in args.accept] + [(f, False) for f in args.reject]
+
+    session_pool = create_session_pool()
+    with session_pool.session("verification") as cur_session:
+        if not init_database(cur_session):
+            raise Exception("Error: Unable to initialize the database")
+        search_service = get_css(cur_session)
+        report = [run_profile(cur_session, search_service, profile, labelled_docs) for profile in profiles]
+    session_pool.close()
+
+    print_report(report)
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(report[0]))
+            writer.writeheader()
+            writer.writerows(report)
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+for key in ["ACCOUNT", "USER", "PASSWORD", "ROLE", "WAREHOUSE"]:
+    os.environ.setdefault(f"SNOWFLAKE_{key}", "test")
+
+from src.cortex import CircuitOpenError, CortexGovernor
+
+
+def make_governor(**overrides):
+    config = {
+        "function_rates": {},
+        "model_rates": {},
+        "concurrency": {"default": (4, 1, 16)},
+        "max_retries": 1,
+        "backoff_base": 0,
+        "backoff_cap": 0,
+        "failure_threshold": 2,
+        "reset_timeout": 0,
+        "acquire_timeout": 1,
+    }
+    config.update(overrides)
+    return CortexGovernor(**config)
+
+
+def fail(message):
+    def fn():
+        raise Exception(message)
+    return fn
+
+
+def test_probe_with_non_transient_error_closes_the_circuit():
+    governor = make_governor()
+    for _ in range(2):
+        with pytest.raises(Exception, match="timed out"):
+            governor.call("COMPLETE", fail("request timed out"))
+
+    # The half-open probe reaches the service but the statement itself is bad
+    with pytest.raises(Exception, match="SQL compilation error"):
+        governor.call("COMPLETE", fail("SQL compilation error"))
+
+    assert governor.call("COMPLETE", lambda: "ok") == "ok"
+
+
+def test_open_circuit_short_circuits_calls():
+    governor = make_governor(reset_timeout=60)
+    for _ in range(2):
+        with pytest.raises(Exception, match="timed out"):
+            governor.call("COMPLETE", fail("request timed out"))
+
+    with pytest.raises(CircuitOpenError):
+        governor.call("COMPLETE", lambda: "ok")